@@ -2,51 +2,656 @@ from gevent import monkey
 
 monkey.patch_all()
 
-from apiflask import APIFlask, Schema
-from apiflask.fields import String, Date
-from flask import send_file
+from apiflask import APIFlask, Schema, abort
+from apiflask.fields import String, Date, DateTime
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from datetime import datetime, timedelta, tzinfo
+from flask import request, send_file
 from flask_compress import Compress
+from functools import lru_cache
+from marshmallow import EXCLUDE, ValidationError
+from typing import NamedTuple
+from werkzeug.security import safe_join
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import hashlib
+import json
+import mimetypes
+import mmap
 import os
+import struct
+import time
 
 
 app = APIFlask(__name__, docs_path=None)
 Compress(app)
 
 
+# Pre-compressed siblings written by main.py, in order of preference
+precompressed = (("br", ".br"), ("zstd", ".zst"), ("gzip", ".gz"))
+suffixes = dict(precompressed, identity="")
+
+
+# Build manifest written last by main.py (epg.generator.manifest)
+manifest_path = os.path.join(os.getcwd(), "web", "manifest.json")
+# Never a generation, so the first check loads the build
+generation = ""
+generation_checked = 0.0
+# Content hashes by file name relative to web, and of the DIYP files
+file_digests = {}
+diyp_digests = {}
+# [size, mtime_ns] by file name relative to web, of the files and their siblings
+file_stats = {}
+last_modified = None
+
+
+def read_json(path: str) -> dict:
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def check_generation() -> None:
+    """
+    Take the validators of a new build and drop the cached responses
+    once main.py published it, the manifest is read at most once a second.
+    """
+    global generation, generation_checked, cache_bytes, pack_checked
+    global file_digests, diyp_digests, file_stats, last_modified
+    now = time.monotonic()
+    if now - generation_checked < 1:
+        return
+    generation_checked = now
+    manifest = read_json(manifest_path)
+    if manifest.get("generation") == generation:
+        return
+    generation = manifest.get("generation")
+    file_digests = manifest.get("files", {})
+    file_stats = manifest.get("stats", {})
+    # Kept next to the generation diyp_files points to, see epg.generator.diyp
+    diyp_digests = read_json(
+        os.path.realpath(os.path.join(os.getcwd(), "web", "diyp_files")) + ".json"
+    )
+    try:
+        last_modified = datetime.fromisoformat(manifest["last_update"])
+    except (KeyError, TypeError, ValueError):
+        last_modified = None
+    cache.clear()
+    cache_bytes = 0
+    # The pack of the new build is mapped on the next miss
+    pack_checked = 0.0
+    load_schedule()
+
+
+def entity_tag(digest: str | None, encoding: str) -> str | bool:
+    """
+    A strong ETag from the content hash, one per encoding of the content.
+    True lets werkzeug derive one from the file when the hash is unknown.
+    """
+    if digest is None:
+        return True
+    return digest[:32] if encoding == "identity" else digest[:32] + "-" + encoding
+
+
+def on_the_fly_algorithms(streamed: bool) -> list[str]:
+    algorithms = app.config["COMPRESS_ALGORITHM"]
+    if streamed:
+        # Files are streamed, compressed with their own list of algorithms
+        algorithms = app.config.get("COMPRESS_ALGORITHM_STREAMING", algorithms)
+    if isinstance(algorithms, str):
+        algorithms = algorithms.split(",")
+    return [algorithm.strip() for algorithm in algorithms]
+
+
+def compressed_on_the_fly(mimetype: str | None, length: int, streamed: bool) -> bool:
+    """
+    Whether flask_compress will compress an identity response after the view.
+    The conditional request is then evaluated without ranges, by flask_compress
+    for bodies and by send_opened for files, so ranges must not be cut from
+    the uncompressed body before.
+    """
+    if streamed and not app.config.get("COMPRESS_STREAMS", True):
+        return False
+    return (
+        mimetype in app.config["COMPRESS_MIMETYPES"]
+        and length >= app.config["COMPRESS_MIN_SIZE"]
+        and any(request.accept_encodings[x] for x in on_the_fly_algorithms(streamed))
+    )
+
+
+def not_modified(response) -> bool:
+    """
+    Whether the client has the body of a streamed response flask_compress
+    will compress. flask_compress (1.14) does not evaluate conditional requests
+    of streamed responses and tags what it compresses "<etag>:<algorithm>".
+    """
+    etag, _ = response.get_etag()
+    if request.if_none_match:
+        return etag is not None and any(
+            request.if_none_match.contains_weak(tag)
+            for tag in [etag]
+            + [etag + ":" + x for x in on_the_fly_algorithms(True)]
+        )
+    return (
+        request.if_modified_since is not None
+        and response.last_modified is not None
+        and response.last_modified <= request.if_modified_since
+    )
+
+
+def send_opened(f, name: str, digest: str | None, encoding: str, mimetype: str):
+    """
+    Send an opened file, name relative to web, in one encoding of the content.
+    The manifest validators describe it only if it has the size and mtime the
+    manifest recorded, a file main.py replaced since gets its own from its stat,
+    so a range resumed with If-Range never splices two builds.
+    """
+    stat = os.fstat(f.fileno())
+    etag = entity_tag(digest, encoding)
+    modified = last_modified
+    if etag is True or file_stats.get(name) != [stat.st_size, stat.st_mtime_ns]:
+        etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+        etag = etag if encoding == "identity" else etag + "-" + encoding
+        modified = stat.st_mtime
+    response = send_file(
+        f, mimetype=mimetype, etag=etag, last_modified=modified, conditional=False
+    )
+    response.content_length = stat.st_size
+    if encoding == "identity" and compressed_on_the_fly(mimetype, stat.st_size, True):
+        if not_modified(response):
+            f.close()
+            response.response = []
+            response.status_code = 304
+            response.content_length = None
+        return response
+    return response.make_conditional(
+        request, accept_ranges=True, complete_length=stat.st_size
+    )
+
+
+def send_precompressed(path: str):
+    """
+    Send the pre-compressed sibling of path the client accepts, if there is one.
+    flask_compress leaves responses with a Content-Encoding alone.
+    ETag and Last-Modified come from the build manifest, so polling clients
+    get a 304, and ranges of the chosen encoding resume downloads.
+    """
+    name = os.path.relpath(path, os.path.join(os.getcwd(), "web"))
+    digest = file_digests.get(name)
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    for encoding, suffix in precompressed:
+        if request.accept_encodings[encoding]:
+            try:
+                f = open(path + suffix, "rb")
+            except FileNotFoundError:
+                continue
+            response = send_opened(f, name + suffix, digest, encoding, mimetype)
+            response.headers["Content-Encoding"] = encoding
+            response.vary.add("Accept-Encoding")
+            return response
+    return send_opened(open(path, "rb"), name, digest, "identity", mimetype)
+
+
+# Packed DIYP store written by main.py with DIYP_PACK=true,
+# laid out as in epg.generator.diyp.write_pack
+pack_path = os.path.join(os.getcwd(), "web", "diyp.pack")
+pack_trailer = struct.Struct("<Q8s")
+# (stat key, mapping, encoding positions, entries), None if there is no pack
+pack = None
+pack_checked = 0.0
+
+
+def close_pack() -> None:
+    # Read slices are copies, nothing holds on to the mapping
+    global pack
+    if pack is not None:
+        pack[1].close()
+    pack = None
+
+
+def load_pack():
+    """
+    Map the packed DIYP store, again once main.py replaced it, and drop
+    the mapping once main.py removed it (DIYP_PACK turned off).
+    The mapping is shared with the other workers through the page cache,
+    the file is checked for a new build at most once a second.
+    """
+    global pack, pack_checked
+    now = time.monotonic()
+    if now - pack_checked < 1:
+        return pack
+    pack_checked = now
+    try:
+        stat = os.stat(pack_path)
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if pack is not None and pack[0] == key:
+            return pack
+        close_pack()
+        with open(pack_path, "rb") as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        trailer = len(mapping) - pack_trailer.size
+        length, magic = pack_trailer.unpack_from(mapping, trailer)
+        if magic != b"DIYPACK1":
+            raise ValueError("not a diyp pack")
+        index = json.loads(mapping[trailer - length : trailer])
+    except (OSError, ValueError, struct.error):
+        # Serve the files instead
+        close_pack()
+        return None
+    positions = {encoding: i for i, encoding in enumerate(index["encodings"])}
+    pack = (key, mapping, positions, index["entries"])
+    return pack
+
+
+def read_packed(name: str, accepted: tuple[str, ...]):
+    """
+    Read a file of the packed DIYP store from the mapping.
+    The slice is copied to bytes, WSGI servers (gunicorn) only write bytes
+    and a view would pin the mapping of a replaced pack.
+
+    Returns:
+        tuple[bytes, str] | None: The body in the first packed encoding
+            of accepted (else identity) and the encoding, None if it is not packed.
+    """
+    key, mapping, positions, entries = pack
+    entry = entries.get(name)
+    if entry is None:
+        return None
+    for encoding in accepted + ("identity",):
+        if encoding in positions and entry[2 * positions[encoding] + 1] >= 0:
+            i = 2 * positions[encoding]
+            offset, length = entry[i : i + 2]
+            return mapping[offset : offset + length], encoding
+    return None
+
+
+def read_file(path: str | None, accepted: tuple[str, ...]):
+    """
+    Read path or its first pre-compressed sibling in accepted.
+
+    Returns:
+        tuple[bytes, str] | None: The body and its encoding, None if there is no file.
+    """
+    if path is None:
+        return None
+    for encoding in accepted + ("identity",):
+        try:
+            with open(path + suffixes[encoding], "rb") as f:
+                return f.read(), encoding
+        except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+            continue
+    return None
+
+
+# Serialized /diyp responses by (ch, date, accepted encodings), least recently
+# used first, None for channel/date pairs without a file. Bounded by bytes,
+# cleared when main.py publishes a new build manifest.
+cache = OrderedDict()
+cache_size = int(os.getenv("DIYP_CACHE_SIZE", "64")) * 1024 * 1024
+cache_bytes = 0
+# The bytes a negative entry is counted for
+negative_size = 256
+
+
+def cache_get(key, load):
+    """
+    Get the cached value of key, or load it and cache it, evicting the least
+    recently used values beyond cache_size.
+    """
+    global cache_bytes
+    try:
+        value = cache[key]
+        cache.move_to_end(key)
+        return value
+    except KeyError:
+        pass
+    value = load()
+    size = len(value[0]) if value is not None else negative_size
+    if size <= cache_size:
+        cache[key] = value
+        cache_bytes += size
+        while cache_bytes > cache_size:
+            _, evicted = cache.popitem(last=False)
+            cache_bytes -= len(evicted[0]) if evicted is not None else negative_size
+    return value
+
+
+def send_body(body, encoding: str, digest: str | None, mimetype: str):
+    response = app.response_class([body], mimetype=mimetype)
+    response.content_length = len(body)
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    etag = entity_tag(digest, encoding)
+    if etag is not True:
+        response.set_etag(etag)
+    response.last_modified = last_modified
+    if encoding == "identity" and compressed_on_the_fly(mimetype, len(body), False):
+        return response
+    return response.make_conditional(
+        request, accept_ranges=True, complete_length=len(body)
+    )
+
+
 class ChannelIn(Schema):
     ch = String(required=True)
     date = Date("%Y-%m-%d", required=True)
 
 
-@app.route("/diyp")
-@app.input(ChannelIn, "query")
-def diyp(query_data):
-    ch = query_data["ch"]
-    date = query_data["date"]
+def validate_diyp() -> dict:
     try:
-        return send_file(
-            os.path.join(
-                os.getcwd(),
-                "web",
-                "diyp_files",
-                ch,
-                date.strftime("%Y-%m-%d") + ".json",
-            )
+        return ChannelIn().load(request.args, unknown=EXCLUDE)
+    except ValidationError as error:
+        abort(
+            app.config["VALIDATION_ERROR_STATUS_CODE"],
+            app.config["VALIDATION_ERROR_DESCRIPTION"],
+            {"query": error.messages},
         )
-    except FileNotFoundError:
-        return send_file(os.path.join(os.getcwd(), "web", "404.json"))
+
+
+def load_diyp(accepted: tuple[str, ...]):
+    # Validated on a cache miss only, hits are known good queries
+    query_data = validate_diyp()
+    return read_diyp(
+        query_data["ch"] + "/" + query_data["date"].strftime("%Y-%m-%d") + ".json",
+        accepted,
+    )
+
+
+def read_diyp(name: str, accepted: tuple[str, ...]):
+    """
+    Read a DIYP file from the pack or the files.
+
+    Returns:
+        tuple[bytes, str, str | None] | None: The body, its encoding
+            and the content hash, None if there is no such file.
+    """
+    value = None
+    if load_pack() is not None:
+        value = read_packed(name, accepted)
+    if value is None:
+        value = read_file(
+            safe_join(os.path.join(os.getcwd(), "web", "diyp_files"), name), accepted
+        )
+    if value is None:
+        return None
+    return value + (diyp_digests.get(name),)
+
+
+# The cache key of the 404.json body, apart from any (ch, date) query
+not_found = object()
+
+
+def load_not_found(accepted: tuple[str, ...]):
+    value = read_file(os.path.join(os.getcwd(), "web", "404.json"), accepted)
+    if value is None:
+        return None
+    return value + (file_digests.get("404.json"),)
+
+
+@app.route("/diyp")
+def diyp():
+    check_generation()
+    accepted = tuple(
+        encoding
+        for encoding, suffix in precompressed
+        if request.accept_encodings[encoding]
+    )
+    ch = request.args.get("ch")
+    date = request.args.get("date")
+    if ch is None or date is None:
+        validate_diyp()
+    value = cache_get((ch, date, accepted), lambda: load_diyp(accepted))
+    if value is None:
+        value = cache_get((not_found, accepted), lambda: load_not_found(accepted))
+    if value is None:
+        abort(404)
+    return send_body(*value, "application/json")
+
+
+class BatchIn(Schema):
+    # Comma separated channel names
+    channels = String(required=True)
+    start_date = Date("%Y-%m-%d", required=True)
+    end_date = Date("%Y-%m-%d", load_default=None)
+
+
+# The most dates a batch covers
+batch_max_days = 31
+
+
+def load_compact(ch: str, date: str):
+    """
+    A DIYP file as compact json, from its cached identity payload.
+    """
+    value = cache_get((ch, date, ()), lambda: read_diyp(ch + "/" + date + ".json", ()))
+    if value is None:
+        return None
+    body, encoding, digest = value
+    compact = json.dumps(
+        json.loads(body), ensure_ascii=False, separators=(",", ":")
+    ).encode()
+    return compact, "identity", digest
+
+
+@app.route("/diyp/batch")
+@app.input(BatchIn, "query")
+def diyp_batch(query_data):
+    """
+    The DIYP files of channels over a date range in one document,
+    {"days": [<DIYP file>, ...]}, files that don't exist are left out.
+    It is compressed once by flask_compress.
+    """
+    check_generation()
+    start_date = query_data["start_date"]
+    end_date = query_data["end_date"] or start_date
+    days = (end_date - start_date).days + 1
+    if days < 1 or days > batch_max_days:
+        abort(400, f"The date range must cover 1 to {batch_max_days} days")
+    dates = [(start_date + timedelta(n)).strftime("%Y-%m-%d") for n in range(days)]
+    bodies = []
+    digests = []
+    for ch in query_data["channels"].split(","):
+        for date in dates:
+            # Keyed apart from the /diyp payloads by the encodings slot
+            value = cache_get((ch, date, ("compact",)), lambda: load_compact(ch, date))
+            if value is not None:
+                bodies.append(value[0])
+                digests.append(value[2])
+    body = b'{"days":[' + b",".join(bodies) + b"]}"
+    digest = None
+    if None not in digests:
+        digest = hashlib.sha256("".join(digests).encode()).hexdigest()
+    return send_body(body, "identity", digest, "application/json")
+
+
+class ChannelIndex(NamedTuple):
+    id: str
+    name: str
+    timezone: tzinfo
+    # Sorted start times and the stop times, UTC epochs
+    starts: array
+    stops: array
+    # [start, stop, title, desc] rows, in the order of starts
+    programs: list
+
+
+# The schedule written by main.py (epg.generator.schedule), channels in build
+# order and the same indexes by channel name and id
+schedule_path = os.path.join(os.getcwd(), "web", "schedule.json")
+schedule_channels: list[ChannelIndex] = []
+schedule: dict[str, ChannelIndex] = {}
+
+
+def load_schedule() -> None:
+    """
+    Index the schedule, leaving out the programs and channels it can't,
+    e.g. programs without a stop in a schedule.json of an older build.
+    """
+    global schedule_channels, schedule
+    channels = []
+    for channel in read_json(schedule_path).get("channels", []):
+        try:
+            timezone = ZoneInfo(channel["timezone"])
+        except (KeyError, TypeError, ValueError, ZoneInfoNotFoundError):
+            timezone = ZoneInfo("Asia/Shanghai")
+        try:
+            programs = [
+                program
+                for program in channel["programs"]
+                if len(program) == 4
+                and isinstance(program[0], int)
+                and isinstance(program[1], int)
+            ]
+            channels.append(
+                ChannelIndex(
+                    channel["id"],
+                    channel["name"],
+                    timezone,
+                    array("q", (program[0] for program in programs)),
+                    array("q", (program[1] for program in programs)),
+                    programs,
+                )
+            )
+        except (KeyError, TypeError, OverflowError):
+            continue
+    index = {channel.id: channel for channel in channels}
+    index.update((channel.name, channel) for channel in channels)
+    schedule_channels, schedule = channels, index
+
+
+@lru_cache(maxsize=65536)
+def format_time(epoch: int, timezone: tzinfo) -> str:
+    return datetime.fromtimestamp(epoch, timezone).isoformat()
+
+
+def program_json(channel: ChannelIndex, i: int) -> dict:
+    start, stop, title, desc = channel.programs[i]
+    return {
+        "start": format_time(start, channel.timezone),
+        "end": format_time(stop, channel.timezone),
+        "title": title,
+        "desc": desc,
+    }
+
+
+def now_next(channel: ChannelIndex, now: int) -> dict:
+    """
+    The programs on now and next of a channel, by bisecting its start times.
+    """
+    i = bisect_right(channel.starts, now)
+    return {
+        "channel_name": channel.name,
+        "now": (
+            program_json(channel, i - 1)
+            if i > 0 and channel.stops[i - 1] > now
+            else None
+        ),
+        "next": program_json(channel, i) if i < len(channel.starts) else None,
+    }
+
+
+@app.route("/now")
+def now_playing():
+    check_generation()
+    now = int(time.time())
+    ch = request.args.get("ch")
+    if ch is None:
+        return {"channels": [now_next(channel, now) for channel in schedule_channels]}
+    channel = schedule.get(ch)
+    if channel is None:
+        abort(404, f"Channel not found: {ch}")
+    return now_next(channel, now)
+
+
+class GridIn(Schema):
+    start = DateTime(required=True)
+    end = DateTime(required=True)
+    # Comma separated channel names or ids, all channels if not given
+    channels = String(load_default=None)
+
+
+def to_epoch(value: datetime) -> int:
+    # Naive times are Asia/Shanghai, as in epg.model
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=ZoneInfo("Asia/Shanghai"))
+    return int(value.timestamp())
+
+
+def between(channel: ChannelIndex, start: int, end: int) -> range:
+    """
+    The positions of the programs of a channel overlapping start..end.
+    """
+    i = bisect_right(channel.starts, start)
+    if i > 0 and channel.stops[i - 1] > start:
+        i -= 1
+    return range(i, bisect_left(channel.starts, end, i))
+
+
+@app.route("/grid")
+@app.input(GridIn, "query")
+def grid(query_data):
+    check_generation()
+    start = to_epoch(query_data["start"])
+    end = to_epoch(query_data["end"])
+    if end <= start:
+        abort(400, "end must be after start")
+    if query_data["channels"] is None:
+        channels = schedule_channels
+    else:
+        names = query_data["channels"].split(",")
+        channels = [schedule[name] for name in names if name in schedule]
+
+    def generate():
+        # One channel at a time, so memory stays flat whatever the window
+        yield '{"channels":['
+        for n, channel in enumerate(channels):
+            yield ("," if n else "") + json.dumps(
+                {
+                    "channel_name": channel.name,
+                    "programs": [
+                        program_json(channel, i) for i in between(channel, start, end)
+                    ],
+                },
+                ensure_ascii=False,
+            )
+        yield "]}"
+
+    return app.response_class(generate(), mimetype="application/json")
 
 
 @app.route("/")
 def index():
-    return send_file(os.path.join(os.getcwd(), "web", "index.html"))
+    check_generation()
+    return send_precompressed(os.path.join(os.getcwd(), "web", "index.html"))
 
 
 @app.route("/epg.xml")
 def epg_xml():
-    return send_file(os.path.join(os.getcwd(), "web", "epg.xml"))
+    check_generation()
+    return send_precompressed(os.path.join(os.getcwd(), "web", "epg.xml"))
+
+
+@app.route("/epg.xml.gz")
+def epg_xml_gz():
+    # The gzip sibling of epg.xml as a file of its own, there is none
+    # when gz is not in COMPRESS_FORMATS
+    check_generation()
+    try:
+        f = open(os.path.join(os.getcwd(), "web", "epg.xml.gz"), "rb")
+    except FileNotFoundError:
+        abort(404)
+    return send_opened(
+        f, "epg.xml.gz", file_digests.get("epg.xml"), "gzip", "application/gzip"
+    )
 
 
 @app.route("/robots.txt")
 def robots_txt():
     return send_file(os.path.join(os.getcwd(), "web", "robots.txt"))
+
+
+check_generation()
@@ -0,0 +1,74 @@
+"""
+Benchmark the memory held by Program objects for a 1000-channel/7-day schedule.
+Compares a dict-backed copy of the previous Program with the slotted, interning one.
+
+Run from the repository root:
+    python benchmarks/program_memory.py [channels] [days]
+"""
+
+import os
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from epg.model import Program
+from epg.scraper import tz_shanghai
+
+
+class DictProgram:
+    # The previous Program: a plain __dict__ object without interning
+    def __init__(
+        self, title, start_time, end_time, channel_id, desc="", episode="", sub_title=""
+    ) -> None:
+        self.title = title
+        self.sub_title = sub_title
+        self.start_time = start_time
+        self.end_time = end_time
+        self.desc = desc
+        self.episode = episode
+        self.channel = channel_id
+
+
+def build_schedule(program_class, num_channels: int, days: int) -> list:
+    start = datetime.now(tz_shanghai).replace(hour=0, minute=0, second=0, microsecond=0)
+    channels = []
+    for i in range(num_channels):
+        programs = []
+        pointer = start
+        n = 0
+        while pointer < start + timedelta(days):
+            end = pointer + timedelta(minutes=30 + 15 * (n % 4))
+            # Strings are built per program, as a scraper decoding a response does
+            programs.append(
+                program_class(
+                    "".join(["精彩节目-暂未提供节目预告信息", str(n % 40 or "")]),
+                    pointer,
+                    end,
+                    "".join([f"CH{i}", "@tvsou.com"]),
+                )
+            )
+            pointer = end
+            n += 1
+        channels.append(programs)
+    return channels
+
+
+def measure(program_class, num_channels: int, days: int) -> tuple[int, int]:
+    tracemalloc.start()
+    schedule = build_schedule(program_class, num_channels, days)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, sum(len(programs) for programs in schedule)
+
+
+if __name__ == "__main__":
+    num_channels = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    dict_size, programs = measure(DictProgram, num_channels, days)
+    slots_size, _ = measure(Program, num_channels, days)
+    print(f"schedule: {num_channels} channels, {days} days, {programs} programs")
+    print(f"dict Program:    {dict_size / 1e6:8.1f} MB ({dict_size / programs:.0f} B/program)")
+    print(f"slotted Program: {slots_size / 1e6:8.1f} MB ({slots_size / programs:.0f} B/program)")
+    print(f"saved:           {1 - slots_size / dict_size:8.1%}")
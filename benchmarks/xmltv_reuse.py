@@ -0,0 +1,92 @@
+"""
+Benchmark parsing the reused XMLTV on a 1000-channel/7-day guide.
+Compares the per-channel xpath parser with __xmltv.parse_channels.
+
+Run from the repository root:
+    python benchmarks/xmltv_reuse.py [channels] [days]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lxml import etree
+from epg.model import Channel, Program
+from epg.generator import xmltv
+from epg.scraper import tz_shanghai, __xmltv
+
+
+def make_guide(num_channels: int, days: int) -> bytes:
+    start = datetime.now(tz_shanghai).replace(hour=0, minute=0, second=0, microsecond=0)
+    channels = []
+    for i in range(num_channels):
+        channel = Channel(f"CH{i}", {"name": [f"Channel {i}"]})
+        channel.metadata["last_update"] = start
+        pointer = start
+        n = 0
+        while pointer < start + timedelta(days):
+            end = pointer + timedelta(minutes=30 + 15 * (n % 4))
+            channel.programs.append(
+                Program(f"Program {n % 97}", pointer, end, channel.id, f"desc {n % 13}")
+            )
+            pointer = end
+            n += 1
+        channels.append(channel)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "epg.xml")
+        xmltv.write(path, channels)
+        return open(path, "rb").read()
+
+
+def parse_channels_xpath(xml: bytes) -> list[Channel]:
+    # The previous implementation: one xpath query and a re-sort per programme
+    root = etree.XML(xml)
+    channels = []
+    for xml_channel in root.iter("channel"):
+        channel_names = [x.text for x in xml_channel.iter("display-name")]
+        channels.append(Channel(xml_channel.get("id"), {"name": channel_names}))
+    for channel in channels:
+        programs = []
+        for xml_programme in root.xpath(f"//programme[@channel='{channel.id}']"):
+            start_time = datetime.strptime(xml_programme.get("start"), "%Y%m%d%H%M%S %z")
+            end_time = datetime.strptime(xml_programme.get("stop"), "%Y%m%d%H%M%S %z")
+            title = xml_programme.find("title").text
+            desc = (
+                xml_programme.find("desc").text
+                if xml_programme.find("desc") is not None
+                else ""
+            )
+            programs.append(
+                Program(title, start_time, end_time, channel.id + "@xmltv", desc)
+            )
+            programs.sort(key=lambda x: x.start_time)
+        channel.programs = programs
+    return channels
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    num_channels = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+    xml = make_guide(num_channels, days)
+    print(f"guide: {num_channels} channels, {days} days, {len(xml) / 1e6:.1f} MB")
+
+    dtd = etree.DTD(open("xmltv.dtd", "r")) if os.path.exists("xmltv.dtd") else None
+    new_time, new_channels = timed(__xmltv.parse_channels, xml, dtd)
+    old_time, old_channels = timed(parse_channels_xpath, xml)
+
+    assert [c.programs for c in new_channels] == [c.programs for c in old_channels]
+    programs = sum(len(c.programs) for c in new_channels)
+    print(f"programmes: {programs}")
+    print(f"xpath per channel: {old_time:8.2f} s")
+    print(f"single pass:       {new_time:8.2f} s (with DTD validation)")
+    print(f"speedup:           {old_time / new_time:8.1f} x")
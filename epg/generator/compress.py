@@ -0,0 +1,112 @@
+"""
+Pre-compressed siblings of the output files, e.g. epg.xml.gz next to epg.xml.
+nginx (gzip_static) and api/app.py send them as they are,
+so no response is compressed per request.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def compress_gzip(data: bytes) -> bytes:
+    # mtime=0 keeps the output identical for identical input
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def compress_brotli(data: bytes) -> bytes:
+    return brotli.compress(data, quality=11)
+
+
+def compress_zstd(data: bytes) -> bytes:
+    return zstandard.ZstdCompressor(level=zstandard.MAX_COMPRESSION_LEVEL).compress(
+        data
+    )
+
+
+# File suffix -> (compressor, available)
+compressors = {
+    "gz": (compress_gzip, True),
+    "br": (compress_brotli, brotli is not None),
+    "zst": (compress_zstd, zstandard is not None),
+}
+
+
+def compress_file(path: str, formats: list[str]) -> int:
+    with open(path, "rb") as f:
+        data = f.read()
+    for suffix in formats:
+        compressed = compressors[suffix][0](data)
+        # Replace atomically, the server may be sending the old file
+        with open(path + "." + suffix + ".tmp", "wb") as f:
+            f.write(compressed)
+        os.replace(path + "." + suffix + ".tmp", path + "." + suffix)
+    return len(formats)
+
+
+def replace(staged: str, path: str) -> None:
+    """
+    Move a staged file and its compressed siblings over path and its siblings,
+    the siblings first, so they all change within a few renames.
+    Siblings of path in a format that was not staged are removed, they hold the old content.
+
+    Args:
+        staged (str): The staged file, compressed with write.
+        path (str): The file to replace.
+    """
+    for suffix in compressors:
+        if os.path.exists(staged + "." + suffix):
+            os.replace(staged + "." + suffix, path + "." + suffix)
+        elif os.path.exists(path + "." + suffix):
+            os.remove(path + "." + suffix)
+    os.replace(staged, path)
+
+
+def write(
+    paths: list[str], formats: list[str] = ["gz"], max_workers: int | None = None
+) -> int:
+    """
+    Write compressed siblings of files at the highest compression level, in parallel.
+
+    Args:
+        paths (list[str]): The files, directories are walked recursively.
+        formats (list[str]): The suffixes to write: "gz", "br" (needs brotli) and "zst" (needs zstandard).
+        max_workers (int | None): The number of compressing threads.
+
+    Returns:
+        int: The number of compressed files written.
+    """
+    usable = []
+    for suffix in formats:
+        if suffix not in compressors:
+            print(f"unknown compression format: {suffix}")
+        elif not compressors[suffix][1]:
+            print(f"compression format {suffix} is not installed, skipped")
+        else:
+            usable.append(suffix)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                files.extend(
+                    os.path.join(dirpath, filename)
+                    for filename in filenames
+                    if filename.rsplit(".", 1)[-1] not in compressors
+                )
+        elif os.path.isfile(path):
+            files.append(path)
+    if not usable or not files:
+        return 0
+    # zlib, brotli and zstandard release the GIL while compressing
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(lambda path: compress_file(path, usable), files))
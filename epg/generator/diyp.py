@@ -19,51 +19,242 @@
 # }
 
 from epg.model import Channel
+from epg.generator import compress
+from datetime import datetime
+from functools import lru_cache
+import hashlib
 import json
 import os
 import shutil
+import struct
+import time
 
+# Packed store: the json files and their compressed siblings back to back,
+# then the index as json, then the index length and the magic.
+PACK_MAGIC = b"DIYPACK1"
+PACK_TRAILER = struct.Struct("<Q8s")
+# Compressed sibling suffix -> Content-Encoding
+pack_encodings = {"br": "br", "zst": "zstd", "gz": "gzip"}
 
-def write(dir: str, channels: list[Channel]) -> bool:
-    if not os.path.exists(dir):
-        os.makedirs(dir)
+
+@lru_cache(maxsize=65536)
+def format_time(epoch: int) -> str:
+    """
+    Format a program time (UTC epoch) as local "%H:%M", once per distinct time.
+    """
+    return datetime.fromtimestamp(epoch).strftime("%H:%M")
+
+
+def manifest_path(generation: str) -> str:
+    """
+    The content hashes of a generation are kept next to its directory,
+    outside the served tree.
+    """
+    return generation + ".json"
+
+
+def read_manifest(generation: str) -> dict[str, str]:
+    try:
+        with open(manifest_path(generation), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def link_or_write(source: str | None, target: str, data: bytes | None) -> bool:
+    """
+    Hard-link source to target, or write data to target if it can't be linked.
+
+    Returns:
+        bool: True if target was linked.
+    """
+    if os.path.lexists(target):
+        # Channels sharing a name overwrite each other, as before
+        os.remove(target)
+    if source is not None:
+        try:
+            os.link(source, target)
+            return True
+        except OSError:
+            pass
+    if data is not None:
+        with open(target, "wb") as f:
+            f.write(data)
+    return False
+
+
+def write_pack(path: str, dir: str, names: list[str], formats: list[str]) -> int:
+    """
+    Pack the json files of dir and their compressed siblings into one file.
+    The index maps "channel name/date.json" to the offset and length of the
+    file in each encoding, "identity" first. The file is replaced atomically.
+
+    Args:
+        path (str): The pack file.
+        dir (str): The directory of json files.
+        names (list[str]): The json files relative to dir.
+        formats (list[str]): The compressed sibling suffixes to pack.
+
+    Returns:
+        int: The size of the pack.
+    """
+    suffixes = [suffix for suffix in formats if suffix in pack_encodings]
+    encodings = ["identity"] + [pack_encodings[suffix] for suffix in suffixes]
+    entries = {}
+    offset = 0
+    with open(path + ".tmp", "wb") as f:
+        for name in names:
+            entry = []
+            for suffix in [""] + ["." + suffix for suffix in suffixes]:
+                try:
+                    with open(os.path.join(dir, name + suffix), "rb") as g:
+                        data = g.read()
+                except FileNotFoundError:
+                    # Not packed in this encoding
+                    entry.extend((0, -1))
+                    continue
+                f.write(data)
+                entry.extend((offset, len(data)))
+                offset += len(data)
+            entries[name] = entry
+        index = json.dumps(
+            {"encodings": encodings, "entries": entries},
+            ensure_ascii=False,
+            separators=(",", ":"),
+        ).encode()
+        f.write(index)
+        f.write(PACK_TRAILER.pack(len(index), PACK_MAGIC))
+        size = f.tell()
+    os.replace(path + ".tmp", path)
+    return size
+
+
+def publish(dir: str, staging: str) -> None:
+    """
+    Point the dir symlink at staging in one rename, so readers see either
+    the whole previous generation or the whole new one.
+    """
+    parent = os.path.dirname(dir)
+    link = os.path.join(parent, "." + os.path.basename(dir) + ".tmp")
+    if os.path.lexists(link):
+        os.remove(link)
+    # Relative, so it also resolves where web/ is mounted elsewhere (nginx container)
+    os.symlink(os.path.relpath(staging, parent), link)
+    if os.path.isdir(dir) and not os.path.islink(dir):
+        # A plain directory from an older build, moved aside once,
+        # removed by the next build
+        os.rename(dir, staging + ".legacy")
+    os.replace(link, dir)
+
+
+def write(
+    dir: str,
+    channels: list[Channel],
+    compress_formats: list[str] = [],
+    atomic: bool = True,
+    max_workers: int | None = None,
+    pack: str | None = None,
+) -> bool:
+    """
+    Write one json file per channel and date.
+    Each build goes to a new generation directory next to dir (dir + "_builds"),
+    files whose content hash is unchanged since the previous generation are
+    hard-linked with their compressed siblings instead of being written again,
+    then dir is swapped to the new generation atomically.
+    The content hashes of a generation are written next to it, see manifest_path.
+    The previous generation is kept for readers still holding it, older ones are removed.
+
+    Args:
+        dir (str): The served directory, a symlink to the current generation.
+        channels (list[Channel]): The channels.
+        compress_formats (list[str]): Compressed siblings to write, see compress.write.
+        atomic (bool): Build in staging and swap, False writes dir in place
+            (e.g. on Cloudflare Pages, which does not follow symlinks).
+        max_workers (int | None): The number of compressing threads.
+        pack (str | None): Also write the generation as a packed store there,
+            see write_pack.
+
+    Returns:
+        bool: True when the generation is published.
+    """
+    builds = dir + "_builds"
+    # Siblings of formats that can't be written are never there to link
+    linked_formats = [
+        suffix
+        for suffix in compress_formats
+        if compress.compressors.get(suffix, (None, False))[1]
+    ]
+    if atomic:
+        current = os.path.realpath(dir) if os.path.islink(dir) else None
+        previous = read_manifest(current) if current else {}
+        staging = os.path.join(builds, str(time.time_ns()))
     else:
-        shutil.rmtree(dir)
-        os.makedirs(dir)
+        current = None
+        previous = {}
+        staging = dir
+        if os.path.lexists(dir):
+            if os.path.islink(dir):
+                os.remove(dir)
+            else:
+                shutil.rmtree(dir)
+    os.makedirs(staging)
+    manifest = {}
+    changed = []
+    num_linked = 0
     for channel in channels:
-        channel_epg = {}
-        for program in channel.programs:
-            try:
-                channel_epg[program.start_time.strftime("%Y-%m-%d")]["channel_name"]
-            except KeyError:
-                channel_epg[program.start_time.strftime("%Y-%m-%d")] = {}
-            channel_epg[program.start_time.strftime("%Y-%m-%d")][
-                "channel_name"
-            ] = channel.metadata["name"][0]
-            channel_epg[program.start_time.strftime("%Y-%m-%d")][
-                "date"
-            ] = program.start_time.strftime("%Y-%m-%d")
-            try:
-                channel_epg[program.start_time.strftime("%Y-%m-%d")]["epg_data"]
-            except KeyError:
-                channel_epg[program.start_time.strftime("%Y-%m-%d")]["epg_data"] = []
-            channel_epg[program.start_time.strftime("%Y-%m-%d")]["epg_data"].append(
-                {
-                    "start": program.start_time.astimezone().strftime(
-                        "%H:%M"
-                    ),  # astimezone() is necessary
-                    "end": program.end_time.astimezone().strftime(
-                        "%H:%M"
-                    ),  # astimezone() is necessary
-                    "title": program.title,
-                    "desc": program.desc,
-                }
-            )
-        for date in channel_epg:
-            json_dir = os.path.join(dir, channel_epg[date]["channel_name"])
-            if not os.path.exists(json_dir):
-                os.makedirs(json_dir)
-            json_path = os.path.join(json_dir, channel_epg[date]["date"] + ".json")
-            with open(json_path, "w") as f:
-                json.dump(channel_epg[date], f, ensure_ascii=False, indent=4)
+        channel_name = channel.metadata["name"][0]
+        json_dir = os.path.join(staging, channel_name)
+        if not os.path.exists(json_dir):
+            os.makedirs(json_dir)
+        for day, programs in channel.programs.days():
+            channel_epg = {
+                "channel_name": channel_name,
+                "date": day.strftime("%Y-%m-%d"),
+                "epg_data": [
+                    {
+                        "start": format_time(program.start),
+                        "end": format_time(program.stop),
+                        "title": program.title,
+                        "desc": program.desc,
+                    }
+                    for program in programs
+                ],
+            }
+            data = json.dumps(channel_epg, ensure_ascii=False, indent=4).encode()
+            digest = hashlib.sha256(data).hexdigest()
+            name = channel_name + "/" + channel_epg["date"] + ".json"
+            json_path = os.path.join(json_dir, channel_epg["date"] + ".json")
+            source = None
+            if previous.get(name) == digest:
+                source = os.path.join(current, name)
+            if link_or_write(source, json_path, data) and all(
+                link_or_write(source + "." + suffix, json_path + "." + suffix, None)
+                for suffix in linked_formats
+            ):
+                num_linked += 1
+            else:
+                changed.append(json_path)
+            manifest[name] = digest
+    compress.write(changed, compress_formats, max_workers)
+    if atomic:
+        with open(manifest_path(staging), "w") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+    print(f"diyp files: {len(changed)} written, {num_linked} unchanged", flush=True)
+    if pack is not None:
+        size = write_pack(pack, staging, list(manifest), linked_formats)
+        print(f"diyp pack: {len(manifest)} files, {size / 1e6:.1f} MB", flush=True)
+    if not atomic:
+        return True
+    publish(dir, staging)
+    # Compared resolved, web/ may itself be reached through a symlink.
+    # A plain directory moved aside by publish is kept like a previous generation.
+    keep = {os.path.realpath(staging), os.path.realpath(staging) + ".legacy", current}
+    for name in os.listdir(builds):
+        path = os.path.realpath(os.path.join(builds, name))
+        if path.removesuffix(".json") in keep:
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            os.remove(path)
     return True
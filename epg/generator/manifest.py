@@ -0,0 +1,66 @@
+"""
+The build manifest, web/manifest.json, written last by main.py.
+api/app.py drops its cached responses when the generation changes and takes
+the ETag and Last-Modified of the files it serves from it, as long as the
+file it opened has the size and mtime recorded here.
+"""
+
+from epg.generator.compress import compressors
+from datetime import datetime
+import hashlib
+import json
+import os
+import time
+
+
+def file_digest(path: str) -> str | None:
+    """
+    The sha256 of a file, None if there is no such file.
+    """
+    try:
+        with open(path, "rb") as f:
+            return hashlib.file_digest(f, "sha256").hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def write(path: str, files: list[str]) -> dict:
+    """
+    Write the manifest of a finished build, atomically.
+
+    Args:
+        path (str): The manifest file, the files are named relative to its directory.
+        files (list[str]): The files to record the content hash of.
+
+    Returns:
+        dict: The manifest.
+    """
+    root = os.path.dirname(path)
+    manifest = {
+        "generation": str(time.time_ns()),
+        "last_update": datetime.now().astimezone().isoformat(timespec="seconds"),
+        "files": {},
+        # [size, mtime_ns] of the files and of their compressed siblings
+        "stats": {},
+    }
+    for file in files:
+        digest = file_digest(file)
+        if digest is None:
+            continue
+        manifest["files"][os.path.relpath(file, root)] = digest
+        mtime_ns = os.stat(file).st_mtime_ns
+        for sibling in [file] + [file + "." + suffix for suffix in compressors]:
+            try:
+                stat = os.stat(sibling)
+            except FileNotFoundError:
+                continue
+            # A sibling older than the file was not compressed from it
+            if stat.st_mtime_ns >= mtime_ns:
+                manifest["stats"][os.path.relpath(sibling, root)] = [
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                ]
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+    os.replace(path + ".tmp", path)
+    return manifest
@@ -0,0 +1,60 @@
+# The schedule api/app.py answers /now from, one row per program:
+# {
+#     "channels": [
+#         {
+#             "id": "CCTV1",
+#             "name": "CCTV1",
+#             "timezone": "Asia/Shanghai",
+#             "programs": [[1696867200, 1696870740, "title", "desc"], ...]
+#         }
+#     ]
+# }
+# Times are UTC epochs, programs are sorted by start time. A program without
+# a stop ends when the next one starts, a last one without a stop is left out.
+
+from epg.model import Channel
+import json
+import os
+
+
+def rows(channel: Channel) -> list[list]:
+    rows = []
+    programs = iter(channel.programs)
+    program = next(programs, None)
+    while program is not None:
+        following = next(programs, None)
+        stop = program.stop
+        if stop is None and following is not None:
+            stop = following.start
+        if stop is not None:
+            rows.append([program.start, stop, program.title, program.desc])
+        program = following
+    return rows
+
+
+def write(filepath: str, channels: list[Channel]) -> bool:
+    """
+    Write the schedule of all channels, atomically.
+
+    Args:
+        filepath (str): The schedule file.
+        channels (list[Channel]): The channels.
+
+    Returns:
+        bool: True when written.
+    """
+    schedule = {
+        "channels": [
+            {
+                "id": channel.id,
+                "name": channel.metadata["name"][0],
+                "timezone": getattr(channel.timezone, "key", "Asia/Shanghai"),
+                "programs": rows(channel),
+            }
+            for channel in channels
+        ]
+    }
+    with open(filepath + ".tmp", "w") as f:
+        json.dump(schedule, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(filepath + ".tmp", filepath)
+    return True
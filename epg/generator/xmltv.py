@@ -1,6 +1,10 @@
 from lxml import etree
-from epg.model import Channel
+from xml.sax.saxutils import escape
+import re
+from epg.model import Channel, Program
 from datetime import datetime, timezone, timedelta
+from functools import lru_cache
+import os
 
 def fix_datetime(dt):
     """确保时间统一为 UTC+8"""
@@ -10,50 +14,116 @@ def fix_datetime(dt):
         return dt.replace(tzinfo=timezone(timedelta(hours=8)))  # 如果没有时区信息，则设置为 UTC+8
     return dt.astimezone(timezone(timedelta(hours=8)))  # 转换为 UTC+8 时区
 
-def write(filepath: str, channels: list[Channel], info: str = "") -> bool:
-    root = etree.Element("tv")
-    tree = etree.ElementTree(root)
-    tree.docinfo.system_url = "xmltv.dtd"
-    root.set("generator-info-name", info)
+@lru_cache(maxsize=65536)
+def format_time(epoch: int) -> str:
+    """节目时间（UTC epoch）格式化为 UTC+8 的 xmltv 时间，同一时刻只格式化一次"""
+    return datetime.fromtimestamp(epoch, timezone(timedelta(hours=8))).strftime(
+        "%Y%m%d%H%M%S %z"
+    )
 
+
+# XML 1.0 不允许的控制字符，直接去掉
+invalid_chars = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]")
+attribute_entities = {'"': "&quot;", "\n": "&#10;", "\r": "&#13;", "\t": "&#9;"}
+
+
+@lru_cache(maxsize=65536)
+def escape_text(text: str | None) -> str:
+    """转义元素文本，标题等重复的文本只转义一次"""
+    if text is None:
+        return ""
+    return escape(invalid_chars.sub("", text))
+
+
+def escape_attribute(value: str) -> str:
+    return escape(invalid_chars.sub("", value), attribute_entities)
+
+
+def channel_element(channel: Channel) -> etree._Element:
+    channel_element = etree.Element("channel", id=channel.id)
+    for name in channel.metadata.get("name", []):
+        display_name = etree.SubElement(channel_element, "display-name")
+        display_name.text = name
+    return channel_element
+
+
+def programme_lines(channel_id: str, program: Program, pretty_print: bool) -> str:
+    # 时间以 UTC epoch 保存，直接格式化为 UTC+8
+    stop = (
+        format_time(program.stop)
+        if program.stop is not None
+        else fix_datetime(None).strftime("%Y%m%d%H%M%S %z")
+    )
+    indent, child_indent = ("\n  ", "\n    ") if pretty_print else ("", "")
+    lines = [
+        f'{indent}<programme start="{format_time(program.start)}" stop="{stop}"'
+        f' channel="{channel_id}">',
+        f"{child_indent}<title>{escape_text(program.title)}</title>",
+    ]
+    if program.sub_title:
+        lines.append(
+            f"{child_indent}<sub-title>{escape_text(program.sub_title)}</sub-title>"
+        )
+    if program.desc:
+        lines.append(f"{child_indent}<desc>{escape_text(program.desc)}</desc>")
+    lines.append(f"{indent}</programme>")
+    return "".join(lines)
+
+
+def write(
+    filepath: str,
+    channels: list[Channel],
+    info: str = "",
+    pretty_print: bool = True,
+    dtd: etree.DTD | None = None,
+) -> bool:
+    """
+    Write channels to an xmltv file, atomically.
+    Elements are streamed to the file one by one, so memory does not grow with the guide.
+    Programmes are formatted from templates, they always have the attributes and
+    the title the DTD requires, so only channel elements need validating.
+
+    Args:
+        filepath (str): The xmltv file.
+        channels (list[Channel]): The channels to write.
+        info (str): The generator-info-name.
+        pretty_print (bool): Indent the output.
+        dtd (etree.DTD | None): Validate each channel element against it if given.
+
+    Returns:
+        bool: False if a channel element is not valid against dtd, True otherwise.
+    """
     # 计算最新的更新时间
+    root = f'<tv generator-info-name="{escape_attribute(info)}"'
     last_update_time_list = [
         fix_datetime(channel.metadata.get("last_update"))
         for channel in channels if "last_update" in channel.metadata
     ]
     if last_update_time_list:
         last_update_time = max(last_update_time_list)
-        root.set("date", last_update_time.strftime("%Y%m%d%H%M%S %z"))
-
-    # 生成频道信息
-    for channel in channels:
-        channel_element = etree.SubElement(root, "channel", id=channel.id)
-        for name in channel.metadata.get("name", []):
-            display_name = etree.SubElement(channel_element, "display-name")
-            display_name.text = name
-
-    # 处理节目单
-    for channel in channels:
-        # **这里修正**: 先转换时间，然后再排序，但保持原始的 program 对象
-        for program in channel.programs:
-            program.start_time = fix_datetime(program.start_time)
-            program.end_time = fix_datetime(program.end_time)
-
-        channel.programs.sort(key=lambda p: p.start_time)
-
-        for program in channel.programs:
-            program_element = etree.SubElement(root, "programme",
-                                              start=program.start_time.strftime("%Y%m%d%H%M%S %z"),
-                                              stop=program.end_time.strftime("%Y%m%d%H%M%S %z"),
-                                              channel=channel.id)
-            title = etree.SubElement(program_element, "title")
-            title.text = program.title
-            if program.sub_title:
-                sub_title = etree.SubElement(program_element, "sub-title")
-                sub_title.text = program.sub_title
-            if program.desc:
-                desc = etree.SubElement(program_element, "desc")
-                desc.text = program.desc
-
-    tree.write(filepath, pretty_print=True, xml_declaration=True, encoding="utf-8")
-    return True
+        root += f' date="{last_update_time.strftime("%Y%m%d%H%M%S %z")}"'
+
+    valid = True
+    newline = "\n" if pretty_print else ""
+    with open(filepath + ".tmp", "w", encoding="utf-8", buffering=1024 * 1024) as f:
+        f.write("<?xml version='1.0' encoding='UTF-8'?>\n")
+        f.write('<!DOCTYPE tv SYSTEM "xmltv.dtd">\n')
+        f.write(root + ">")
+        # 生成频道信息
+        for channel in channels:
+            element = channel_element(channel)
+            if dtd is not None and valid and not dtd.validate(element):
+                print(dtd.error_log.filter_from_errors()[0])
+                valid = False
+            if pretty_print:
+                etree.indent(element, level=1)
+                f.write("\n  ")
+            f.write(etree.tostring(element, encoding="unicode"))
+        # 处理节目单，channel.programs 已按开始时间排序
+        for channel in channels:
+            channel_id = escape_attribute(channel.id)
+            for program in channel.programs:
+                f.write(programme_lines(channel_id, program, pretty_print))
+        f.write(newline + "</tv>" + newline)
+    os.replace(filepath + ".tmp", filepath)
+    return valid
@@ -3,54 +3,125 @@ This defines Program and Channel model.
 Basic proterties and functions.
 """
 
-from datetime import datetime, date, timedelta
-from collections.abc import Callable
+import asyncio
+import bisect
+import math
+import sys
+from datetime import datetime, date, timedelta, tzinfo
+from collections.abc import Awaitable, Callable, Iterable, Iterator
 from typing import Any
+from zoneinfo import ZoneInfo
 from epg.scraper import tz_shanghai
 
 
+def intern(value: str | None) -> str | None:
+    """
+    Intern a string repeated across programs, e.g. a series title or source tag.
+    """
+    return sys.intern(value) if type(value) is str else value
+
+
+def to_epoch(value: datetime | int | None) -> int | None:
+    """
+    Convert a program time to a UTC epoch, naive datetimes are in Asia/Shanghai.
+    """
+    if value is None or type(value) is int:
+        return value
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=tz_shanghai)
+    return math.floor(value.timestamp())
+
+
+def epoch(dt: datetime) -> int:
+    """
+    Timeline key of a query time, naive datetimes are in local time.
+    """
+    return math.floor(dt.timestamp())
+
+
 class Program:
     """
     Program model.
+    It is slotted and interns title and channel, as a build holds tens of thousands.
+    Times are stored as UTC epochs with the timezone of the source,
+    start_time and end_time convert them from and to datetimes.
+    Naive datetimes are taken as Asia/Shanghai.
 
     Attributes:
         title (str): The program title.
+        sub_title (str): The program sub title.
+        start (int): The program start time, UTC epoch in seconds.
+        stop (int | None): The program end time, UTC epoch in seconds.
+        tz (tzinfo): The timezone of start_time and end_time.
         start_time (datetime): The program start time.
         end_time (datetime): The program end time.
-        channel (str): The channel id.
+        channel (str): The channel id, tagged with the source, e.g. "cctv1@tvsou.com".
         desc (str): The program description.
         episode (str): The program episode.
+        scraper_id (str | None): The plugin that rewrote it, e.g. "cctv9@weibo".
     """
 
+    __slots__ = (
+        "title",
+        "sub_title",
+        "start",
+        "stop",
+        "tz",
+        "desc",
+        "episode",
+        "channel",
+        "scraper_id",
+    )
+
     def __init__(
         self,
         title: str,
-        start_time: datetime,
-        end_time: datetime,
+        start_time: datetime | int,
+        end_time: datetime | int | None,
         channel_id: str,
         desc: str = "",
         episode: str = "",
         sub_title: str = "",
     ) -> None:
-        self.title = title
+        self.title = intern(title)
         self.sub_title = sub_title
-        self.start_time = start_time
-        self.end_time = end_time
+        self.tz = getattr(start_time, "tzinfo", None) or tz_shanghai
+        self.start = to_epoch(start_time)
+        self.stop = to_epoch(end_time)
         self.desc = desc
         self.episode = episode
-        self.channel = channel_id
+        self.channel = intern(channel_id)
+        self.scraper_id = None
+
+    @property
+    def start_time(self) -> datetime:
+        return datetime.fromtimestamp(self.start, self.tz)
+
+    @start_time.setter
+    def start_time(self, value: datetime | int) -> None:
+        self.start = to_epoch(value)
+
+    @property
+    def end_time(self) -> datetime | None:
+        if self.stop is None:
+            return None
+        return datetime.fromtimestamp(self.stop, self.tz)
+
+    @end_time.setter
+    def end_time(self, value: datetime | int | None) -> None:
+        self.stop = to_epoch(value)
 
     def __eq__(self, other) -> bool:
         if isinstance(other, Program):
             return (
-                self.start_time == other.start_time
-                and self.end_time == other.end_time
+                self.start == other.start
+                and self.stop == other.stop
                 and self.title == other.title
             )
         return False
 
     def __hash__(self) -> int:
-        return hash((self.start_time, self.end_time, self.title))
+        return hash((self.start, self.stop, self.title))
 
     def __str__(self) -> str:
         return (
@@ -58,6 +129,178 @@ class Program:
         )
 
 
+class Timeline:
+    """
+    Programs of a channel, kept sorted by start time in per-day buckets.
+    Buckets are keyed by the date of the program start time in the channel
+    timezone, so replacing, dropping or enumerating a day only touches that day.
+    Each bucket has a parallel list of epoch start keys answering time queries
+    through bisect. Scrapers append programs mostly in order, which is O(1),
+    out of order programs are inserted at their place.
+    """
+
+    def __init__(
+        self, programs: Iterable[Program] = (), timezone: tzinfo = tz_shanghai
+    ) -> None:
+        self.timezone = timezone
+        self.__dates: list[date] = []
+        self.__programs: dict[date, list[Program]] = {}
+        self.__starts: dict[date, list[int]] = {}
+        self.__len = 0
+        self.extend(programs)
+
+    def append(self, program: Program) -> None:
+        start = program.start
+        day = datetime.fromtimestamp(start, self.timezone).date()
+        starts = self.__starts.get(day)
+        if starts is None:
+            bisect.insort(self.__dates, day)
+            self.__starts[day] = [start]
+            self.__programs[day] = [program]
+        elif start >= starts[-1]:
+            starts.append(start)
+            self.__programs[day].append(program)
+        else:
+            index = bisect.bisect_right(starts, start)
+            starts.insert(index, start)
+            self.__programs[day].insert(index, program)
+        self.__len += 1
+
+    def extend(self, programs: Iterable[Program]) -> None:
+        for program in programs:
+            self.append(program)
+
+    def dates(self) -> list[date]:
+        """
+        Get the dates having programs, in order.
+        """
+        return list(self.__dates)
+
+    def day(self, day: date) -> list[Program]:
+        """
+        Get the programs starting on day.
+        """
+        return list(self.__programs.get(day, ()))
+
+    def days(
+        self, start_date: date | None = None, end_date: date | None = None
+    ) -> Iterator[tuple[date, list[Program]]]:
+        """
+        Iterate the days in order, with their programs.
+
+        Args:
+            start_date (date | None): The first day, inclusive.
+            end_date (date | None): The last day, inclusive.
+        """
+        low = 0 if start_date is None else bisect.bisect_left(self.__dates, start_date)
+        high = (
+            len(self.__dates)
+            if end_date is None
+            else bisect.bisect_right(self.__dates, end_date)
+        )
+        for day in self.__dates[low:high]:
+            yield day, self.__programs[day]
+
+    def drop(self, day: date) -> None:
+        """
+        Remove the programs starting on day.
+        """
+        if day in self.__programs:
+            self.__dates.remove(day)
+            self.__len -= len(self.__programs.pop(day))
+            del self.__starts[day]
+
+    def __bucket(self, key: int) -> int:
+        # Index of the last day starting at or before key, -1 if none
+        low, high = 0, len(self.__dates)
+        while low < high:
+            middle = (low + high) // 2
+            if self.__starts[self.__dates[middle]][0] <= key:
+                low = middle + 1
+            else:
+                high = middle
+        return low - 1
+
+    def at(self, time: datetime) -> Program | None:
+        """
+        Get the program playing at time.
+        """
+        key = epoch(time)
+        bucket = self.__bucket(key)
+        if bucket < 0:
+            return None
+        day = self.__dates[bucket]
+        program = self.__programs[day][bisect.bisect_right(self.__starts[day], key) - 1]
+        if program.stop is not None and program.stop < time.timestamp():
+            return None
+        return program
+
+    def after(self, time: datetime) -> Program | None:
+        """
+        Get the first program starting after time.
+        """
+        key = epoch(time)
+        for day in self.__dates[max(self.__bucket(key), 0) :]:
+            index = bisect.bisect_right(self.__starts[day], key)
+            if index < len(self.__starts[day]):
+                return self.__programs[day][index]
+        return None
+
+    def between(self, start: datetime, end: datetime) -> list[Program]:
+        """
+        Get the programs starting from start (inclusive) to end (exclusive).
+        """
+        start_key, end_key = epoch(start), epoch(end)
+        programs = []
+        for day in self.__dates[max(self.__bucket(start_key), 0) :]:
+            starts = self.__starts[day]
+            if starts[0] >= end_key:
+                break
+            programs.extend(
+                self.__programs[day][
+                    bisect.bisect_left(starts, start_key) : bisect.bisect_left(
+                        starts, end_key
+                    )
+                ]
+            )
+        return programs
+
+    def sort(self, *args, **kwargs) -> None:
+        """
+        Programs are always sorted by start time, kept for list compatibility.
+        """
+        return None
+
+    def __iter__(self) -> Iterator[Program]:
+        for day in self.__dates:
+            yield from self.__programs[day]
+
+    def __len__(self) -> int:
+        return self.__len
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        # Walk the day buckets, not the programs
+        if index < 0:
+            index += self.__len
+        if not 0 <= index < self.__len:
+            raise IndexError("Timeline index out of range")
+        for day in self.__dates:
+            programs = self.__programs[day]
+            if index < len(programs):
+                return programs[index]
+            index -= len(programs)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, (Timeline, list)):
+            return list(self) == list(other)
+        return False
+
+    def __repr__(self) -> str:
+        return f"Timeline({list(self)!r})"
+
+
 class Channel:
     """
     Channel model.
@@ -65,12 +308,18 @@ class Channel:
     Attributes:
         id (str): The channel id.
         metadata (dict): The channel metadata.
-        programs (list[Program]): The programs of the channel.
+        timezone (tzinfo): The channel timezone, from the "timezone" metadata,
+            Asia/Shanghai by default. Program dates are in this timezone.
+        programs (Timeline): The programs of the channel, sorted by start time.
+            Assigning a list of programs converts it.
 
     Methods:
         update(date: date = datetime.today().date()) -> bool: Update channel with new data for the given date.
+        update_async(date: date) -> bool: Coroutine version of update, used by the asyncio build runner.
+        update_range(start_date: date, end_date: date) -> set[date]: Coroutine updating a date range with one request, if the source supports it.
         now_playing(now: datetime = datetime.now()) -> Program | None: Get the program that is currently playing.
         next_program(now: datetime = datetime.now()) -> Program | None: Get the next program.
+        programs_between(start: datetime, end: datetime) -> list[Program]: Get the programs starting in a time range.
     """
 
     def __init__(
@@ -78,6 +327,10 @@ class Channel:
         id: str,
         metadata: dict = {},
         update_callable: Callable[[Any, date], bool] | None = None,
+        update_async_callable: Callable[[Any, date], Awaitable[bool]] | None = None,
+        update_range_callable: (
+            Callable[[Any, date, date], Awaitable[set[date]]] | None
+        ) = None,
     ) -> None:
         self.__id = id
         self.metadata = metadata
@@ -85,7 +338,12 @@ class Channel:
             {"last_update": datetime(1970, 1, 1, 0, 0, 0, tzinfo=tz_shanghai)}
         )
         self.__update_callable = update_callable
-        self.programs = []
+        self.__update_async_callable = update_async_callable
+        self.__update_range_callable = update_range_callable
+        self.timezone = (
+            ZoneInfo(metadata["timezone"]) if metadata.get("timezone") else tz_shanghai
+        )
+        self.programs = Timeline()
 
     def __eq__(self, other) -> bool:
         if isinstance(other, str):
@@ -97,6 +355,17 @@ class Channel:
     def __str__(self) -> str:
         return f'Channel(id={self.__id}, name={self.metadata["name"]}, {len(self.programs)} programs)'
 
+    @property
+    def programs(self) -> Timeline:
+        return self.__programs
+
+    @programs.setter
+    def programs(self, value: Iterable[Program]) -> None:
+        if isinstance(value, Timeline) and value.timezone == self.timezone:
+            self.__programs = value
+        else:
+            self.__programs = Timeline(value, self.timezone)
+
     @property
     def id(self) -> str:
         return self.__id
@@ -120,6 +389,37 @@ class Channel:
             return update_result
         return False
 
+    async def update_async(self, date: date) -> bool:
+        """
+        Update channel with new data for the given date, from a coroutine.
+        Falls back to update() in a worker thread if there is no async callable.
+
+        Args:
+            date (date): The date for which to update the model.
+
+        Returns:
+            bool: True if the update was successful, False otherwise.
+        """
+        if self.__update_async_callable is not None:
+            return await self.__update_async_callable(self, date)
+        return await asyncio.to_thread(self.update, date)
+
+    async def update_range(self, start_date: date, end_date: date) -> set[date]:
+        """
+        Update channel from start_date to end_date (inclusive) with one request,
+        from a coroutine.
+
+        Args:
+            start_date (date): The first date.
+            end_date (date): The last date.
+
+        Returns:
+            set[date]: The dates updated. The others need update_async() one by one.
+        """
+        if self.__update_range_callable is not None:
+            return await self.__update_range_callable(self, start_date, end_date)
+        return set()
+
     def now_playing(self, now: datetime = datetime.now()) -> Program | None:
         """
         Get the program that is currently playing.
@@ -130,14 +430,7 @@ class Channel:
         Returns:
             Program: The program that is currently playing, or None if no program is playing.
         """
-        for program in self.programs:
-            if (
-                program.start_time.astimezone()
-                <= now.astimezone()
-                <= program.end_time.astimezone()
-            ):
-                return program
-        return None
+        return self.programs.at(now)
 
     def next_program(self, now: datetime = datetime.now()) -> Program | None:
         """
@@ -149,17 +442,24 @@ class Channel:
         Returns:
             Program: The next program, or None if there is no next program.
         """
-        self.programs.sort(key=lambda x: x.start_time)
-        for program in self.programs:
-            if program.start_time.astimezone() > now.astimezone():
-                return program
-        return None
+        return self.programs.after(now)
+
+    def programs_between(self, start: datetime, end: datetime) -> list[Program]:
+        """
+        Get the programs starting in a time range.
+
+        Args:
+            start (datetime): The start of the range, inclusive.
+            end (datetime): The end of the range, exclusive.
+
+        Returns:
+            list[Program]: The programs, sorted by start time.
+        """
+        return self.programs.between(start, end)
 
     def flush(self, date) -> None:
         """
         Flush all programs of date
         """
-        self.programs = [
-            program for program in self.programs if program.start_time.date() != date
-        ]
+        self.programs.drop(date)
         return None
@@ -1,4 +1,4 @@
-import requests
+from epg.scraper import session
 
 # 请求头
 headers = {
@@ -31,7 +31,7 @@ def search(keyword: str, page: int = 1) -> list:
 
     # 发送请求
     try:
-        r = requests.get(API_ENDPOINT, headers=headers, params=params, timeout=5)
+        r = session.get(API_ENDPOINT, headers=headers, params=params)
     except:
         return []
 
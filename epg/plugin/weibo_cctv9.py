@@ -4,7 +4,7 @@ from .__weibo_search import headers
 from datetime import date, datetime, timedelta
 from epg.model import Channel, Program
 import re
-import requests
+from epg.scraper import session
 import json
 
 keyword = "#每日央视纪录片精选#"
@@ -53,7 +53,7 @@ def update(channel: Channel, date: date) -> int:
             text_url_suffix = re.findall(r'href="(.*?)"', text_weibo)[-1]
             text_url = "https://m.weibo.cn" + text_url_suffix
             try:
-                r = requests.get(text_url, headers=headers, timeout=5)
+                r = session.get(text_url, headers=headers)
             except:
                 continue
             render_data = re.findall(
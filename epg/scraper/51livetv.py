@@ -1,6 +1,7 @@
 from datetime import datetime, date, timedelta
 import requests
 from bs4 import BeautifulSoup
+from epg.scraper import session, single_flight
 from epg.model import Channel, Program  
 import re
 
@@ -22,7 +23,7 @@ def grab_programs(channel_id: str, need_weekday: int) -> tuple:
     """
     channel_baseurl = baseurl + channel_id + "_w" + str(need_weekday) + "/"
     try:
-        res = requests.get(channel_baseurl, headers=headers, timeout=5)
+        res = session.get(channel_baseurl, headers=headers)
         if res.status_code != 200:
             return False
     except requests.RequestException:
@@ -88,6 +89,20 @@ def parse_programs(content: tuple) -> list:
     return programs
 
 
+def fetch_programs(channel_id: str, need_weekday: int) -> list | bool:
+    """
+    抓取并解析节目表。
+    返回: 节目列表，失败返回 False。
+    参数:
+        channel_id (str): 频道 ID。
+        need_weekday (int): 星期几。
+    """
+    bs_programs = grab_programs(channel_id, need_weekday)
+    if not bs_programs:
+        return False
+    return parse_programs(bs_programs)
+
+
 def update(channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()):
     """
     更新频道的节目表。
@@ -109,14 +124,11 @@ def update(channel: Channel, scraper_id: str | None = None, dt: date = datetime.
     elif need_weekday > 6:
         need_weekday -= 7
 
-    # 抓取节目
-    bs_programs = grab_programs(scraper_id, need_weekday)
-    if not bs_programs:
-        return False
-
-    # 解析节目
-    programs = parse_programs(bs_programs)
-    if len(programs) == 0:
+    # 抓取并解析节目，共用同一页面的频道只抓取一次
+    programs = single_flight.do(
+        ("51livetv", scraper_id, need_weekday), fetch_programs, scraper_id, need_weekday
+    )
+    if not programs:
         return False
 
     # 清空频道当天的节目
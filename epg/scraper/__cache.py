@@ -0,0 +1,198 @@
+"""
+Caches for scraper requests.
+ResponseCache is the persistent HTTP response cache of the shared session.
+Bodies are stored with their validators (ETag/Last-Modified) in one SQLite file,
+so rebuilds can revalidate with conditional requests and reuse the body on 304.
+SingleFlight shares fetched and parsed pages between callers within a build.
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Hashable, NamedTuple
+
+
+class CachedResponse(NamedTuple):
+    url: str
+    headers: dict
+    body: bytes
+    stored_at: float
+
+    @property
+    def etag(self) -> str | None:
+        return self.headers.get("etag")
+
+    @property
+    def last_modified(self) -> str | None:
+        return self.headers.get("last-modified")
+
+
+class ResponseCache:
+    """
+    Response cache with LRU eviction under a size cap.
+
+    Attributes:
+        path (str): The SQLite file.
+        max_size (int): Max total body size in bytes.
+    """
+
+    # Headers describing the stored (decoded) body
+    kept_headers = ("content-type", "etag", "last-modified", "cache-control", "expires")
+
+    def __init__(self, path: str, max_size: int = 256 * 1024 * 1024) -> None:
+        self.path = path
+        self.max_size = max_size
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(path, check_same_thread=False)
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, url TEXT, headers TEXT, body BLOB,"
+            " size INTEGER, stored_at REAL, accessed_at REAL)"
+        )
+        self.__db.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+        )
+        self.__db.commit()
+        self.__size = self.__db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def get(self, key: str) -> CachedResponse | None:
+        with self.__lock:
+            row = self.__db.execute(
+                "SELECT url, headers, body, stored_at FROM responses WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            self.__db.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                (time.time(), key),
+            )
+            self.__db.commit()
+        return CachedResponse(row[0], json.loads(row[1]), row[2], row[3])
+
+    def put(self, key: str, url: str, headers, body: bytes) -> None:
+        """
+        Store a 200 response.
+
+        Args:
+            key (str): The cache key.
+            url (str): The response url.
+            headers: The response headers, case insensitive mapping.
+            body (bytes): The decoded response body.
+        """
+        if len(body) > self.max_size:
+            return
+        kept = {
+            name: headers[name] for name in self.kept_headers if name in headers
+        }
+        now = time.time()
+        with self.__lock:
+            old = self.__db.execute(
+                "SELECT size FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            self.__size -= old[0] if old else 0
+            self.__db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, url, json.dumps(kept), body, len(body), now, now),
+            )
+            self.__size += len(body)
+            self.__evict()
+            self.__db.commit()
+
+    def touch(self, key: str) -> None:
+        """
+        Mark an entry as revalidated by a 304 response.
+        """
+        now = time.time()
+        with self.__lock:
+            self.__db.execute(
+                "UPDATE responses SET stored_at = ?, accessed_at = ? WHERE key = ?",
+                (now, now, key),
+            )
+            self.__db.commit()
+
+    def __evict(self) -> None:
+        while self.__size > self.max_size:
+            row = self.__db.execute(
+                "SELECT key, size FROM responses ORDER BY accessed_at LIMIT 1"
+            ).fetchone()
+            if row is None:
+                self.__size = 0
+                return
+            self.__db.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+            self.__size -= row[1]
+
+
+class SingleFlight:
+    """
+    Run a call once per key and share its result with every caller in the build.
+    Concurrent callers, threads or coroutines, wait for the call in flight.
+    Falsy results (failed fetches) are shared with the waiters but not kept,
+    so a later caller tries again.
+    """
+
+    def __init__(self) -> None:
+        self.__futures: dict[Hashable, Future] = {}
+        self.__lock = threading.Lock()
+
+    def __claim(self, key: Hashable) -> tuple[Future, bool]:
+        with self.__lock:
+            future = self.__futures.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self.__futures[key] = future
+            return future, True
+
+    def __settle(self, key: Hashable, future: Future, result: Any) -> None:
+        if not result:
+            with self.__lock:
+                self.__futures.pop(key, None)
+        future.set_result(result)
+
+    def __fail(self, key: Hashable, future: Future, e: BaseException) -> None:
+        with self.__lock:
+            self.__futures.pop(key, None)
+        future.set_exception(e)
+
+    def do(self, key: Hashable, fn: Callable, *args) -> Any:
+        """
+        Return fn(*args), calling it only if no result for key exists or is in flight.
+        """
+        future, leader = self.__claim(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            self.__fail(key, future, e)
+            raise
+        self.__settle(key, future, result)
+        return result
+
+    async def do_async(self, key: Hashable, fn: Callable, *args) -> Any:
+        """
+        Coroutine version of do(), fn(*args) must return an awaitable.
+        """
+        future, leader = self.__claim(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await fn(*args)
+        except BaseException as e:
+            self.__fail(key, future, e)
+            raise
+        self.__settle(key, future, result)
+        return result
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__futures.clear()
@@ -1,9 +1,34 @@
 """
 This folder contains all the scrapers.
 Define update(channel: Channel, scraper_id: str | None = None, dt: date) is necessary.
+Optionally define async update_async(channel, scraper_id, dt) with the same contract,
+it is preferred by the asyncio build runner. The runner updates channels
+concurrently and the dates of a channel one after another.
+Optionally define update_range(channel, scraper_id, start_date, end_date) -> list[date]
+for sources that return several days in one request.
+Scrapers should send their requests through the shared session (or async_get).
 """
 
 from zoneinfo import ZoneInfo
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlsplit
+import asyncio
+import threading
+import time
+import weakref
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
+from .__limiter import TokenBucket
+from .__cache import CachedResponse, ResponseCache, SingleFlight
+
+try:
+    import httpx
+except ImportError:  # async requests fall back to the shared session in a thread
+    httpx = None
 
 headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64)"
@@ -13,3 +38,258 @@ headers = {
 
 tz_shanghai = ZoneInfo("Asia/Shanghai")
 tz_hong_kong = ZoneInfo("Asia/Hong_Kong")
+
+# Default (connect, read) timeout of a request in seconds
+timeout = 5
+# Retry idempotent requests on connection errors and 5xx responses.
+# A timeout is retried once when connecting and never when reading, so a dead
+# host costs at most 2 * timeout per request (one per date for the per-date
+# scrapers) until the breaker of the scraper opens, not 3 * timeout.
+retries = Retry(
+    total=2,
+    connect=1,
+    read=0,
+    backoff_factor=0.5,
+    status_forcelist=(500, 502, 503, 504),
+    raise_on_status=False,
+)
+# Max keep-alive connections kept open to one host
+pool_maxsize = 16
+# Requests per second and burst size allowed per host.
+# Hosts not listed here use default_rate_limit, None means unlimited.
+rate_limits: dict[str, tuple[float, int]] = {"lighttv.tvmao.com": (2.0, 4)}
+default_rate_limit: tuple[float, int] | None = None
+
+# On-disk response cache, off until enable_cache() is called.
+# Entries younger than the TTL of their url, else of their host, are reused
+# without a request, older ones are revalidated with If-None-Match/If-Modified-Since.
+response_cache: ResponseCache | None = None
+cache_ttls: dict[str, float] = {}
+default_cache_ttl = 0.0
+
+# Pages fetched and parsed in this build, keyed by (scraper, scraper_id, page).
+# Channels sharing an upstream page make one request for it.
+single_flight = SingleFlight()
+
+_buckets: dict[str, TokenBucket | None] = {}
+_buckets_lock = threading.Lock()
+_transport_errors: ContextVar[list | None] = ContextVar(
+    "transport_errors", default=None
+)
+
+
+def rate_limiter(url: str) -> TokenBucket | None:
+    """
+    Get the token bucket of the host of url.
+
+    Args:
+        url (str): The request url.
+
+    Returns:
+        TokenBucket | None: The token bucket, or None if the host is unlimited.
+    """
+    host = urlsplit(url).hostname or ""
+    with _buckets_lock:
+        if host not in _buckets:
+            limit = rate_limits.get(host, default_rate_limit)
+            _buckets[host] = TokenBucket(*limit) if limit is not None else None
+        return _buckets[host]
+
+
+@contextmanager
+def track_transport_errors():
+    """
+    Count the transport errors (connection errors, timeouts and 5xx responses)
+    of the requests sent in this context, including worker threads started from it.
+
+    Yields:
+        list[int]: A one-item list holding the count.
+    """
+    errors = [0]
+    token = _transport_errors.set(errors)
+    try:
+        yield errors
+    finally:
+        _transport_errors.reset(token)
+
+
+def record_transport_error() -> None:
+    errors = _transport_errors.get()
+    if errors is not None:
+        errors[0] += 1
+
+
+def enable_cache(path: str, max_size: int = 256 * 1024 * 1024) -> None:
+    """
+    Put the persistent response cache in front of GET requests.
+
+    Args:
+        path (str): The cache file.
+        max_size (int): Max total body size in bytes, least recently used entries are evicted.
+    """
+    global response_cache
+    response_cache = ResponseCache(path, max_size)
+
+
+def cache_lookup(method: str, url: str, kwargs: dict) -> tuple[str | None, CachedResponse | None]:
+    """
+    Look up a request in the response cache.
+    If there is a stale entry, conditional headers are added to kwargs.
+
+    Returns:
+        tuple[str | None, CachedResponse | None]: The cache key (None if the request
+        is not cacheable) and the cached entry.
+    """
+    if response_cache is None or method.upper() != "GET" or kwargs.get("stream"):
+        return None, None
+    key = requests.Request("GET", url, params=kwargs.get("params")).prepare().url
+    entry = response_cache.get(key)
+    if entry is not None and not cache_fresh(url, entry):
+        conditional_headers = dict(kwargs.get("headers") or {})
+        if entry.etag:
+            conditional_headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            conditional_headers["If-Modified-Since"] = entry.last_modified
+        kwargs["headers"] = conditional_headers
+    return key, entry
+
+
+def cache_ttl(url: str) -> float:
+    if url in cache_ttls:
+        return cache_ttls[url]
+    return cache_ttls.get(urlsplit(url).hostname or "", default_cache_ttl)
+
+
+def cache_fresh(url: str, entry: CachedResponse | None) -> bool:
+    return entry is not None and time.time() - entry.stored_at < cache_ttl(url)
+
+
+def cached_response(entry: CachedResponse) -> requests.Response:
+    res = requests.Response()
+    res.status_code = 200
+    res.reason = "OK"
+    res.url = entry.url
+    res.headers = CaseInsensitiveDict(entry.headers)
+    res._content = entry.body
+    res.encoding = requests.utils.get_encoding_from_headers(res.headers)
+    return res
+
+
+def cache_store(key: str, entry: CachedResponse | None, url: str, res):
+    """
+    Store a response, or reuse the cached body on 304.
+
+    Returns:
+        The response to hand to the scraper.
+    """
+    if res.status_code == 304 and entry is not None:
+        response_cache.touch(key)
+        return cached_response(entry)
+    if res.status_code == 200:
+        if cache_ttl(url) > 0 or "etag" in res.headers or "last-modified" in res.headers:
+            response_cache.put(key, str(res.url), res.headers, res.content)
+    return res
+
+
+class Session(requests.Session):
+    """
+    Keep-alive, connection pooled session shared by all scrapers.
+    It sends the default headers, negotiates gzip/deflate (and br/zstd when
+    the decoders are installed), and applies the default timeout and retries.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.headers.update(headers)
+        self.headers["Accept-Encoding"] = ACCEPT_ENCODING
+        adapter = HTTPAdapter(
+            pool_connections=pool_maxsize,
+            pool_maxsize=pool_maxsize,
+            max_retries=retries,
+        )
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", timeout)
+        key, entry = cache_lookup(method, url, kwargs)
+        if cache_fresh(url, entry):
+            return cached_response(entry)
+        bucket = rate_limiter(url)
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            res = super().request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            record_transport_error()
+            raise
+        if res.status_code >= 500:
+            record_transport_error()
+        if key is not None:
+            res = cache_store(key, entry, url, res)
+        return res
+
+
+session = Session()
+
+_async_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+async def async_request(method: str, url: str, **kwargs):
+    """
+    Send a request from a coroutine.
+    Uses a pooled httpx.AsyncClient per event loop when httpx is installed,
+    otherwise runs the shared session in a worker thread.
+    Both responses provide status_code, content, text and json().
+
+    Args:
+        method (str): The HTTP method.
+        url (str): The URL.
+        **kwargs: Passed to the client, e.g. headers, params, data.
+    """
+    if httpx is None:
+        return await asyncio.to_thread(session.request, method, url, **kwargs)
+    key, entry = cache_lookup(method, url, kwargs)
+    if cache_fresh(url, entry):
+        return cached_response(entry)
+    bucket = rate_limiter(url)
+    if bucket is not None:
+        await bucket.acquire_async()
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            headers=dict(session.headers),
+            timeout=timeout,
+            transport=httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(
+                    max_connections=None, max_keepalive_connections=pool_maxsize
+                ),
+                # httpx retries failed connections only
+                retries=retries.connect,
+            ),
+        )
+        _async_clients[loop] = client
+    try:
+        res = await client.request(method, url, **kwargs)
+    except httpx.TransportError:
+        record_transport_error()
+        raise
+    if res.status_code >= 500:
+        record_transport_error()
+    if key is not None:
+        res = cache_store(key, entry, url, res)
+    return res
+
+
+async def async_get(url: str, **kwargs):
+    return await async_request("GET", url, **kwargs)
+
+
+async def aclose() -> None:
+    """
+    Close the async client of the running event loop.
+    """
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
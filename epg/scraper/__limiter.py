@@ -0,0 +1,116 @@
+"""
+Rate limiting and circuit breaking for scrapers.
+TokenBucket is applied per host by the shared session,
+CircuitBreaker per scraper by utils.scrap_channel.
+"""
+
+import asyncio
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, usable from threads and coroutines.
+
+    Attributes:
+        rate (float): Tokens added per second.
+        burst (int): Max tokens in the bucket.
+    """
+
+    def __init__(self, rate: float, burst: int = 1) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.__tokens = float(burst)
+        self.__updated = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """
+        Take a token, going into debt if the bucket is empty.
+
+        Returns:
+            float: Seconds to wait before the token may be used.
+        """
+        with self.__lock:
+            now = time.monotonic()
+            self.__tokens = min(
+                self.burst, self.__tokens + (now - self.__updated) * self.rate
+            )
+            self.__updated = now
+            self.__tokens -= 1
+            if self.__tokens >= 0:
+                return 0.0
+            return -self.__tokens / self.rate
+
+    def acquire(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self) -> None:
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one source.
+    It opens after threshold consecutive failures and rejects calls.
+    After cooldown seconds one trial call is let through,
+    success closes the circuit and failure opens it again.
+
+    Attributes:
+        threshold (int): Consecutive failures to open the circuit.
+        cooldown (float): Seconds to wait before a trial call.
+    """
+
+    def __init__(self, threshold: int = 5, cooldown: float = 60.0) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.__failures = 0
+        self.__opened_at: float | None = None
+        self.__trial = False
+        self.__lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        return self.__opened_at is not None
+
+    def allow(self) -> bool:
+        """
+        Check whether a call may be made.
+
+        Returns:
+            bool: True if the circuit is closed or a trial call is due.
+        """
+        with self.__lock:
+            if self.__opened_at is None:
+                return True
+            if self.__trial:
+                return False
+            if time.monotonic() - self.__opened_at >= self.cooldown:
+                self.__trial = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self.__lock:
+            self.__failures = 0
+            self.__opened_at = None
+            self.__trial = False
+
+    def release(self) -> None:
+        """
+        Give up a call that neither succeeded nor failed, e.g. nothing was requested.
+        """
+        with self.__lock:
+            self.__trial = False
+
+    def record_failure(self) -> None:
+        with self.__lock:
+            self.__failures += 1
+            if self.__trial or self.__failures >= self.threshold:
+                self.__opened_at = time.monotonic()
+            self.__trial = False
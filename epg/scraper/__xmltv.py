@@ -1,67 +1,217 @@
-import requests
 from lxml import etree
 from epg.model import Channel, Program
-from datetime import datetime
-from io import BytesIO
-from . import headers
+from datetime import datetime, date
+from functools import lru_cache
+import requests
+import zlib
+from . import session
 from epg.scraper import tz_shanghai
 
 
-def get_channels(xmltv_url: str, dtd: etree.DTD | None = None) -> list[Channel]:
+@lru_cache(maxsize=65536)
+def parse_time(value: str) -> datetime:
+    """
+    Parse an XMLTV time like "20231201083000 +0800".
+    Programmes of a guide share few distinct times, so the results are cached.
+    """
+    return datetime.strptime(value, "%Y%m%d%H%M%S %z")
+
+
+def parse_last_update(value: str | None) -> datetime:
     try:
-        xml = requests.get(xmltv_url, headers=headers, timeout=5).content
-    except:
-        print("Failed to get XMLTV")
+        return parse_time(value)
+    except (TypeError, ValueError) as e:
+        return datetime(1970, 1, 1, 0, 0, 0, tzinfo=tz_shanghai)
+
+
+def read_channel(xml_channel, last_update: datetime) -> Channel:
+    channel_names = [x.text for x in xml_channel.iterchildren("display-name")]
+    metadata = {"name": channel_names}
+    channel = Channel(xml_channel.get("id"), metadata)
+    channel.metadata.update({"last_update": last_update})
+    return channel
+
+
+def read_programme(
+    xml_programme,
+    channel: Channel,
+    start_date: date | None = None,
+    end_date: date | None = None,
+) -> Program | None:
+    """
+    Read a programme element, or None if it starts outside start_date..end_date.
+    Raises ValueError or TypeError if its start or stop is missing or malformed.
+    """
+    start_time = parse_time(xml_programme.get("start"))
+    if start_date is not None and start_time.date() < start_date:
+        return None
+    if end_date is not None and start_time.date() > end_date:
+        return None
+    title = None
+    sub_title = desc = ""
+    for child in xml_programme.iterchildren("title", "sub-title", "desc"):
+        if child.tag == "title":
+            if title is None:
+                title = child.text
+        elif child.tag == "sub-title":
+            sub_title = child.text or ""
+        else:
+            desc = child.text or ""
+    return Program(
+        title,
+        start_time,
+        parse_time(xml_programme.get("stop")),
+        channel.id + "@xmltv",
+        desc,
+        sub_title=sub_title,
+    )
+
+
+def parse_channels(
+    xml: bytes,
+    dtd: etree.DTD | None = None,
+    channel_ids: set[str] | None = None,
+    start_date: date | None = None,
+    end_date: date | None = None,
+) -> list[Channel]:
+    """
+    Parse an XMLTV document into channels.
+    The document is parsed once and the programmes are grouped in one pass.
+
+    Args:
+        xml (bytes): The XMLTV document.
+        dtd (etree.DTD | None): Validate the document against it if given.
+        channel_ids (set[str] | None): Only keep these channels, None keeps all.
+        start_date (date | None): Only keep programmes starting on or after it.
+        end_date (date | None): Only keep programmes starting on or before it.
+
+    Returns:
+        list[Channel]: The channels, programs sorted by start time.
+    """
+    try:
+        root = etree.XML(xml)
+    except etree.XMLSyntaxError:
+        print("XML is not valid")
         return []
     if dtd != None:
-        xml_bytes = BytesIO(xml)
-        try:
-            root = etree.XML(xml_bytes.read())
-        except:
-            print("XML is not valid")
-            return []
         valid = dtd.validate(root)
         if not valid:
             print(dtd.error_log.filter_from_errors()[0])
             return []
-    root = etree.XML(xml)
+    last_update = parse_last_update(root.get("date"))
+    channels = {}
+    for xml_channel in root.iterchildren("channel"):
+        if channel_ids is None or xml_channel.get("id") in channel_ids:
+            channel = read_channel(xml_channel, last_update)
+            channels[channel.id] = channel
+    for xml_programme in root.iterchildren("programme"):
+        channel = channels.get(xml_programme.get("channel"))
+        if channel is None:
+            continue
+        try:
+            program = read_programme(xml_programme, channel, start_date, end_date)
+        except (ValueError, TypeError):
+            # A programme without a valid start or stop, skip only it
+            continue
+        if program is not None:
+            channel.programs.append(program)
+    return list(channels.values())
+
+
+def get_channels(
+    xmltv_url: str,
+    dtd: etree.DTD | None = None,
+    channel_ids: set[str] | None = None,
+    start_date: date | None = None,
+    end_date: date | None = None,
+) -> list[Channel]:
     try:
-        last_update = datetime.strptime(root.get("date"), "%Y%m%d%H%M%S %z")
-    except (TypeError, ValueError) as e:
-        last_update = datetime(1970, 1, 1, 0, 0, 0, tzinfo=tz_shanghai)
-    channels = []
-    for xml_channel in root.iter("channel"):
-        channel_id = xml_channel.get("id")
-        channel_names = [x.text for x in xml_channel.iter("display-name")]
-        metadata = {"name": channel_names}
-        channels.append(Channel(channel_id, metadata))
-    for channel in channels:
-        channel.metadata.update({"last_update": last_update})
-        xml_programmes = root.xpath(f"//programme[@channel='{channel.id}']")
-        for xml_programme in xml_programmes:
-            start_time = datetime.strptime(
-                xml_programme.get("start"), "%Y%m%d%H%M%S %z"
-            )
-            end_time = datetime.strptime(xml_programme.get("stop"), "%Y%m%d%H%M%S %z")
-            title = xml_programme.find("title").text
-            try:
-                sub_title = xml_programme.find("sub-title").text
-            except:
-                sub_title = ""
-            desc = (
-                xml_programme.find("desc").text
-                if xml_programme.find("desc") is not None
-                else ""
-            )
-            channel.programs.append(
-                Program(
-                    title,
-                    start_time,
-                    end_time,
-                    channel.id + "@xmltv",
-                    desc,
-                    sub_title=sub_title,
+        xml = session.get(xmltv_url).content
+    except:
+        print("Failed to get XMLTV")
+        return []
+    return parse_channels(xml, dtd, channel_ids, start_date, end_date)
+
+
+def stream_channels(
+    xmltv_url: str,
+    channel_ids: set[str] | None = None,
+    start_date: date | None = None,
+    end_date: date | None = None,
+) -> list[Channel]:
+    """
+    Import an XMLTV incrementally, for sources too large to hold as a tree.
+    Elements are cleared as soon as they are read, and only the programmes
+    of channel_ids between start_date and end_date become objects,
+    so memory stays flat whatever the size of the source.
+    Gzipped files (.xml.gz) are decompressed on the fly.
+    The document is not validated and the response cache is bypassed.
+
+    Args:
+        xmltv_url (str): The XMLTV url.
+        channel_ids (set[str] | None): Only keep these channels, None keeps all.
+        start_date (date | None): Only keep programmes starting on or after it.
+        end_date (date | None): Only keep programmes starting on or before it.
+
+    Returns:
+        list[Channel]: The channels, programs sorted by start time.
+    """
+    try:
+        res = session.get(xmltv_url, stream=True)
+        res.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        print("Failed to get XMLTV:", e)
+        return []
+    parser = etree.XMLPullParser(
+        events=("start", "end"), tag=("tv", "channel", "programme")
+    )
+    decompressor = None
+    last_update = None
+    channels = {}
+    try:
+        for chunk in res.iter_content(1024 * 1024):
+            # The file itself may be gzipped, on top of any Content-Encoding
+            if decompressor is None:
+                decompressor = (
+                    zlib.decompressobj(zlib.MAX_WBITS | 16)
+                    if chunk[:2] == b"\x1f\x8b"
+                    else False
                 )
-            )
-            channel.programs.sort(key=lambda x: x.start_time)
-    return channels
+            parser.feed(decompressor.decompress(chunk) if decompressor else chunk)
+            for event, element in parser.read_events():
+                if element.tag == "tv":
+                    if event == "start":
+                        last_update = parse_last_update(element.get("date"))
+                    continue
+                if event == "start":
+                    continue
+                if element.tag == "channel":
+                    if channel_ids is None or element.get("id") in channel_ids:
+                        channel = read_channel(element, last_update)
+                        channels[channel.id] = channel
+                else:
+                    channel = channels.get(element.get("channel"))
+                    if channel is not None:
+                        try:
+                            program = read_programme(
+                                element, channel, start_date, end_date
+                            )
+                        except (ValueError, TypeError):
+                            # A programme without a valid start or stop, skip only it
+                            program = None
+                        if program is not None:
+                            channel.programs.append(program)
+                # Drop the element and the already read siblings before it
+                element.clear()
+                while element.getprevious() is not None:
+                    del element.getparent()[0]
+        parser.close()
+    except (etree.XMLSyntaxError, zlib.error) as e:
+        print("XML is not valid:", e)
+        return []
+    except requests.exceptions.RequestException as e:
+        print("Failed to get XMLTV:", e)
+        return []
+    finally:
+        res.close()
+    return list(channels.values())
@@ -1,62 +1,145 @@
 from epg.model import Channel, Program
 from datetime import datetime, date, timezone, timedelta
-import requests
 import json
-from . import headers, tz_shanghai
+from . import session, async_get, tz_shanghai
 
-def update(
-    channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
-) -> bool:
-    # 根据传入的 scraper_id 或者 channel.id 获取频道的 UUID
-    channel_id = channel.id if scraper_id is None else scraper_id
-    
+
+def get_url(channel_id: str, dt: date, end_dt: date | None = None) -> str:
     # 格式化日期，准备请求参数
+    days = 1 if end_dt is None else (end_dt - dt).days + 1
     start_time = datetime.combine(dt, datetime.min.time()).replace(tzinfo=tz_shanghai)  # 00:00:00
-    end_time = (start_time + timedelta(days=1))  # 24:00:00
+    end_time = (start_time + timedelta(days=days))  # 24:00:00
     
     # 将日期转换为时间戳
     start_time_ts = int(start_time.timestamp())
     end_time_ts = int(end_time.timestamp())
     
     # 构造 API 请求 URL
-    url = f"http://slave.bfgd.com.cn/media/event/get_list?chnlid={channel_id}&pageidx=1&vcontrol=0&attachdesc=1&repeat=1&accesstoken=R5F2408FEU3198804BK78052214IE73560DFP2BF4M340CE68V0Z339CBW1626D4D261E46FEA&starttime={start_time_ts}&endtime={end_time_ts}&pagenum=100&flagposter=0"
-    
-    try:
-        # 发送请求
-        res = requests.get(url, headers=headers, timeout=5)
-    except Exception as e:
-        print(f"Fail: {e}")
-        return False
-    
+    return f"http://slave.bfgd.com.cn/media/event/get_list?chnlid={channel_id}&pageidx=1&vcontrol=0&attachdesc=1&repeat=1&accesstoken=R5F2408FEU3198804BK78052214IE73560DFP2BF4M340CE68V0Z339CBW1626D4D261E46FEA&starttime={start_time_ts}&endtime={end_time_ts}&pagenum={100 * days}&flagposter=0"
+
+
+def get_event_list(res) -> list | None:
     # 如果响应码不是 200，说明请求失败
     if res.status_code != 200:
-        return False
+        return None
     
     # 解析 JSON 数据
     data = json.loads(res.text)
     
     # 判断返回的 total 是否大于 0，即是否有节目数据
     if data["total"] == 0:
-        return False
+        return None
     
     # 获取 event_list 内容部分
     event_list = data["event_list"]
     
+    # 超出单页数量时数据不完整
+    if data["total"] > len(event_list):
+        return None
+    
+    return event_list
+
+
+def make_program(event: dict) -> Program:
+    title = event["event_name"]
+    start_time = datetime.fromtimestamp(event["start_time"], tz=tz_shanghai)
+    end_time = datetime.fromtimestamp(event["end_time"], tz=tz_shanghai)
+    
+    # 创建 Program 对象
+    return Program(title, start_time, end_time, "")
+
+
+def parse_response(channel: Channel, res, dt: date) -> bool:
+    event_list = get_event_list(res)
+    if event_list is None:
+        return False
+    
     # 清空该频道的旧节目数据
     channel.flush(dt)
     
     # 遍历节目列表并更新节目数据
     for event in event_list:
-        title = event["event_name"]
-        start_time = datetime.fromtimestamp(event["start_time"], tz=tz_shanghai)
-        end_time = datetime.fromtimestamp(event["end_time"], tz=tz_shanghai)
-        
-        # 创建并添加 Program 对象
-        channel.programs.append(
-            Program(title, start_time, end_time, "")
-        )
+        channel.programs.append(make_program(event))
     
     # 更新频道的元数据
     channel.metadata.update({"last_update": datetime.now(timezone.utc).astimezone()})
     
     return True
+
+
+def parse_range_response(
+    channel: Channel, res, start_dt: date, end_dt: date
+) -> list[date]:
+    event_list = get_event_list(res)
+    if event_list is None:
+        return []
+    
+    # 按日期拆分节目
+    programs_by_date: dict[date, list[Program]] = {}
+    for event in event_list:
+        program = make_program(event)
+        if start_dt <= program.start_time.date() <= end_dt:
+            programs_by_date.setdefault(program.start_time.date(), []).append(program)
+    
+    # 替换每一天的节目
+    for dt, programs in programs_by_date.items():
+        channel.flush(dt)
+        channel.programs.extend(programs)
+    
+    if programs_by_date:
+        channel.metadata.update({"last_update": datetime.now(timezone.utc).astimezone()})
+    
+    return list(programs_by_date)
+
+
+def update(
+    channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
+) -> bool:
+    # 根据传入的 scraper_id 或者 channel.id 获取频道的 UUID
+    channel_id = channel.id if scraper_id is None else scraper_id
+    url = get_url(channel_id, dt)
+    
+    try:
+        # 发送请求
+        res = session.get(url)
+    except Exception as e:
+        print(f"Fail: {e}")
+        return False
+    
+    return parse_response(channel, res, dt)
+
+
+async def update_async(
+    channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
+) -> bool:
+    channel_id = channel.id if scraper_id is None else scraper_id
+    url = get_url(channel_id, dt)
+    
+    try:
+        # 发送请求
+        res = await async_get(url)
+    except Exception as e:
+        print(f"Fail: {e}")
+        return False
+    
+    return parse_response(channel, res, dt)
+
+
+def update_range(
+    channel: Channel, scraper_id: str | None, start_dt: date, end_dt: date
+) -> list[date]:
+    """
+    Update all dates from start_dt to end_dt with one request.
+    Returns the dates updated.
+    """
+    channel_id = channel.id if scraper_id is None else scraper_id
+    url = get_url(channel_id, start_dt, end_dt)
+    
+    try:
+        # 发送请求
+        res = session.get(url)
+    except Exception as e:
+        print(f"Fail: {e}")
+        return []
+    
+    return parse_range_response(channel, res, start_dt, end_dt)
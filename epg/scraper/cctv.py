@@ -1,21 +1,15 @@
 from epg.model import Channel, Program
 from datetime import datetime, date, timezone
-import requests
 import json
-from . import headers, tz_shanghai
+from . import session, async_get, tz_shanghai
 
 
-def update(
-    channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
-) -> bool:
-    channel_id = channel.id if scraper_id == None else scraper_id
+def get_url(channel_id: str, dt: date) -> str:
     date_str = dt.strftime("%Y%m%d")
-    url = f"http://api.cntv.cn/epg/getEpgInfoByChannelNew?c={channel_id}&serviceId=tvcctv&d={date_str}&t=json"
-    try:
-        res = requests.get(url, headers=headers, timeout=5)
-    except:
-        print("Fail:", url)
-        return False
+    return f"http://api.cntv.cn/epg/getEpgInfoByChannelNew?c={channel_id}&serviceId=tvcctv&d={date_str}&t=json"
+
+
+def parse_response(channel: Channel, channel_id: str, res, dt: date) -> bool:
     # handle error
     if res.status_code != 200:
         return False
@@ -36,3 +30,29 @@ def update(
         )
     channel.metadata.update({"last_update": datetime.now(timezone.utc).astimezone()})
     return True
+
+
+def update(
+    channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
+) -> bool:
+    channel_id = channel.id if scraper_id == None else scraper_id
+    url = get_url(channel_id, dt)
+    try:
+        res = session.get(url)
+    except:
+        print("Fail:", url)
+        return False
+    return parse_response(channel, channel_id, res, dt)
+
+
+async def update_async(
+    channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
+) -> bool:
+    channel_id = channel.id if scraper_id == None else scraper_id
+    url = get_url(channel_id, dt)
+    try:
+        res = await async_get(url)
+    except:
+        print("Fail:", url)
+        return False
+    return parse_response(channel, channel_id, res, dt)
@@ -1,7 +1,6 @@
 from epg.model import Channel, Program
 from datetime import datetime, date, timedelta
-import requests
-from . import headers, tz_shanghai
+from . import session, tz_shanghai
 
 API_ENDPOINT = "https://www.discoverychannel.com.tw/ajax/getschedule.php"
 
@@ -13,7 +12,7 @@ def update(
     date_str = dt.strftime("%Y-%m-%d")
     r_data = {"date": date_str, "channel": channel_id}
     try:
-        res = requests.post(API_ENDPOINT, data=r_data, headers=headers, timeout=5)
+        res = session.post(API_ENDPOINT, data=r_data)
     except:
         print("Fail:", API_ENDPOINT)
         return False
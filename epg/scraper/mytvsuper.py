@@ -2,11 +2,10 @@
 # Channels: https://github.com/iptv-org/epg/blob/master/sites/mytvsuper.com/mytvsuper.com.channels.xml
 # Translated by: https://chat.openai.com/share/e1a723db-d273-4241-97b9-cf8497b5c746
 
-import requests
 import datetime
 import json
 from epg.model import Channel, Program
-from . import tz_hong_kong
+from . import session, tz_hong_kong
 
 API_ENDPOINT = "https://content-api.mytvsuper.com/v1"
 
@@ -52,9 +51,10 @@ def parse_items(content, date):
     return day_data["epg"]
 
 
-def fetch_data(site_channel, date):
-    url = f"{API_ENDPOINT}/epg?network_code={site_channel['site_id']}&from={date.strftime('%Y%m%d')}&to={date.strftime('%Y%m%d')}&platform=web"
-    response = requests.get(url)
+def fetch_data(site_channel, date, end_date=None):
+    end_date = date if end_date is None else end_date
+    url = f"{API_ENDPOINT}/epg?network_code={site_channel['site_id']}&from={date.strftime('%Y%m%d')}&to={end_date.strftime('%Y%m%d')}&platform=web"
+    response = session.get(url)
     response.raise_for_status()
     return response.text
 
@@ -89,7 +89,7 @@ def parse_programs(content, site_channel, date):
 
 
 def get_channels(lang):
-    response = requests.get(f"{API_ENDPOINT}/channel/list?platform=web")
+    response = session.get(f"{API_ENDPOINT}/channel/list?platform=web")
     response.raise_for_status()
     data = response.json()
 
@@ -104,6 +104,17 @@ def get_channels(lang):
     return channels
 
 
+def make_program(channel_id, program):
+    return Program(
+        program["title"],
+        program["start"],
+        program["stop"],
+        channel_id + "@mytvsuper.com",
+        program["description"],
+        program["episode"],
+    )
+
+
 def update(
     channel: Channel,
     scraper_id: str | None = None,
@@ -125,15 +136,43 @@ def update(
         return False
     programs = parse_programs(data, site_channel, dt)
     for program in programs:
-        channel.programs.append(
-            Program(
-                program["title"],
-                program["start"],
-                program["stop"],
-                channel_id + "@mytvsuper.com",
-                program["description"],
-                program["episode"],
-            )
-        )
+        channel.programs.append(make_program(channel_id, program))
     channel.metadata.update({"last_update": datetime.datetime.now().astimezone()})
     return True
+
+
+def update_range(
+    channel: Channel,
+    scraper_id: str | None,
+    start_dt: datetime.date,
+    end_dt: datetime.date,
+) -> list[datetime.date]:
+    """
+    Update all dates from start_dt to end_dt with one request.
+    Returns the dates updated.
+    """
+    channel_id = channel.id if scraper_id == None else scraper_id
+    lang = channel.metadata.get("lang", "tc")
+    site_channel = {
+        "site_id": channel_id,
+        "lang": lang,
+    }
+
+    try:
+        data = fetch_data(site_channel, start_dt, end_dt)
+    except:
+        return []
+    dates = []
+    dt = start_dt
+    while dt <= end_dt:
+        programs = parse_programs(data, site_channel, dt)
+        if programs:
+            # Purge channel programs on this date
+            channel.flush(dt)
+            for program in programs:
+                channel.programs.append(make_program(channel_id, program))
+            dates.append(dt)
+        dt += datetime.timedelta(days=1)
+    if dates:
+        channel.metadata.update({"last_update": datetime.datetime.now().astimezone()})
+    return dates
@@ -1,25 +1,20 @@
-import requests
-import time
 from datetime import date, datetime, timedelta
-from epg.scraper import headers
+from epg.scraper import session, async_get, single_flight
 from epg.model import Channel, Program
 from . import tz_shanghai
 
 
 # Credits to https://github.com/supzhang/epg/blob/master/crawl/spiders/tvmao.py
-def update(
-    channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
-) -> bool:
+def get_url(scraper_id: str, dt: date) -> str | None:
     """
-    Update channel with new data for the given date.
+    Get the schedule url of the given date.
 
     Args:
-        channel (Channel): The channel to update.
         scraper_id (str): The scraper id.
         dt (date): The date to update.
 
     Returns:
-        bool: True if success, False if not.
+        str | None: The url, or None if the date is out of this week.
     """
     now_date = datetime.now().date()
     request_date = dt
@@ -28,10 +23,10 @@ def update(
     need_weekday = now_weekday + delta.days + 1
     if delta.days < 0:
         if abs(delta.days) > now_weekday:
-            return False
+            return None
     if delta.days > 0:
         if delta.days > 6 - now_weekday:
-            return False
+            return None
     id_split = scraper_id.split("-")
     if len(id_split) == 2:
         id = id_split[1]
@@ -39,19 +34,44 @@ def update(
         id = "-".join(id_split[1:3])
     else:
         id = scraper_id
-    url = f"https://lighttv.tvmao.com/qa/qachannelschedule?epgCode={id}&op=getProgramByChnid&epgName=&isNew=on&day={need_weekday}"
-    # time.sleep(1)  # 防止 被BAN
+    return f"https://lighttv.tvmao.com/qa/qachannelschedule?epgCode={id}&op=getProgramByChnid&epgName=&isNew=on&day={need_weekday}"
+
+
+def parse_response(res) -> list | bool:
+    """
+    Get the program list from the response.
+
+    Returns:
+        list | bool: The program list, or False if failed.
+    """
+    if res.status_code != 200:
+        return False
+    data = res.json()
     try:
-        res = requests.get(url, headers=headers, timeout=5)
+        return data[2]["pro"]
     except:
         return False
-    if res.status_code != 200:
+
+
+def fetch_programs(url: str) -> list | bool:
+    try:
+        res = session.get(url)
+    except:
         return False
-    data = res.json()
+    return parse_response(res)
+
+
+async def fetch_programs_async(url: str) -> list | bool:
     try:
-        programs_data = data[2]["pro"]
+        res = await async_get(url)
     except:
         return False
+    return parse_response(res)
+
+
+def update_programs(channel: Channel, programs_data: list | bool, dt: date) -> bool:
+    if programs_data is False:
+        return False
     # Purge channel programs on this date
     channel.flush(dt)
     # Update channel programs on this date, if any
@@ -75,3 +95,40 @@ def update(
     ).replace(year=dt.year, month=dt.month, day=dt.day) + timedelta(days=1)
     channel.programs.append(temp_program)
     return True
+
+
+def update(
+    channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
+) -> bool:
+    """
+    Update channel with new data for the given date.
+
+    Args:
+        channel (Channel): The channel to update.
+        scraper_id (str): The scraper id.
+        dt (date): The date to update.
+
+    Returns:
+        bool: True if success, False if not.
+    """
+    url = get_url(scraper_id, dt)
+    if url is None:
+        return False
+    # Channels sharing a page fetch it once
+    programs_data = single_flight.do(("tvmao", url), fetch_programs, url)
+    return update_programs(channel, programs_data, dt)
+
+
+async def update_async(
+    channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
+) -> bool:
+    """
+    Async version of update().
+    """
+    url = get_url(scraper_id, dt)
+    if url is None:
+        return False
+    programs_data = await single_flight.do_async(
+        ("tvmao", url), fetch_programs_async, url
+    )
+    return update_programs(channel, programs_data, dt)
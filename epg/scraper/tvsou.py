@@ -1,8 +1,7 @@
 from epg.model import Channel, Program
 from datetime import datetime, date, timedelta
-import requests
 from bs4 import BeautifulSoup
-from . import tz_shanghai, headers
+from . import tz_shanghai, session, single_flight
 
 baseurl = "https://www.tvsou.com/epg/"
 
@@ -17,9 +16,7 @@ def grab_programs(channel_id: str, need_weekday: int) -> tuple:
     """
     channel_baseurl = baseurl + channel_id + "/"  # get channel_id
     try:
-        res = requests.get(
-            channel_baseurl + "w" + str(need_weekday), headers=headers, timeout=5
-        )
+        res = session.get(channel_baseurl + "w" + str(need_weekday))
     except:
         return False
     content = None
@@ -81,6 +78,20 @@ def parse_programs(content: tuple) -> list:
     return programs
 
 
+def fetch_programs(channel_id: str, need_weekday: int) -> list | bool:
+    """
+    Grab and parse the programs of a weekday.
+    Return: the program list, False if failed.
+    Args:
+        channel_id (str): The channel id.
+        need_weekday (int): The weekday to grab.
+    """
+    bs_programs = grab_programs(channel_id, need_weekday)
+    if not bs_programs:
+        return False
+    return parse_programs(bs_programs)
+
+
 def update(
     channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
 ):
@@ -103,11 +114,13 @@ def update(
     if delta.days > 0:
         if delta.days > 6 - now_weekday:
             return False
-    bs_programs = grab_programs(scraper_id, need_weekday)
-    if not bs_programs:
+    # Channels sharing a page grab and parse it once
+    programs = single_flight.do(
+        ("tvsou", scraper_id, need_weekday), fetch_programs, scraper_id, need_weekday
+    )
+    if programs is False:
         return False
     else:
-        programs = parse_programs(bs_programs)
         # Purge channel programs on this date
         channel.flush(dt)
         # Update channel programs on this date, if any
@@ -1,34 +1,108 @@
-import __xmltv
 from epg.model import Channel, Program
 from datetime import datetime, date, timezone
+from . import __xmltv, cache_ttls, single_flight
+
+# Seconds a downloaded upstream guide is reused across builds from the
+# response cache without a request, 0 means revalidate it every build.
+cache_ttl = 0.0
+# Import upstream guides incrementally, for sources too large to hold as a tree
+stream = False
+
+# Filled by prepare(): the channel ids wanted from each url and the date window,
+# so only the programmes this build needs are kept.
+channel_ids: dict[str, set[str]] = {}
+date_window: tuple[date, date] | None = None
+
+
+def split_params(scraper_params: str) -> tuple[str | None, str]:
+    """
+    Split "id@url" scraper params, the id is optional.
+
+    Returns:
+        tuple[str | None, str]: The channel id in the upstream guide and the url.
+    """
+    if scraper_params.find("@http") == -1:
+        return None, scraper_params
+    scraper_id = scraper_params.split("@http", 1)[0]
+    return scraper_id or None, "http" + scraper_params.split("@http", 1)[1]
+
+
+def prepare(
+    channels: list[tuple[str, str]], start_date: date, end_date: date
+) -> None:
+    """
+    Register the channels and dates of this build before scraping.
+
+    Args:
+        channels (list[tuple[str, str]]): The channel ids and their scraper params.
+        start_date (date): The first date any channel needs.
+        end_date (date): The last date any channel needs.
+    """
+    global date_window
+    for channel_id, scraper_params in channels:
+        scraper_id, scraper_url = split_params(scraper_params)
+        channel_ids.setdefault(scraper_url, set()).add(scraper_id or channel_id)
+    date_window = (start_date, end_date)
+
+
+def load_programs(scraper_url: str) -> dict[str, dict[date, list[Program]]]:
+    """
+    Download and parse an upstream XMLTV, indexed by channel id and date.
+
+    Args:
+        scraper_url (str): The XMLTV url.
+
+    Returns:
+        dict[str, dict[date, list[Program]]]: The programs of each channel on each date.
+    """
+    if cache_ttl > 0:
+        # Only this guide, not the other requests to its host
+        cache_ttls[scraper_url] = cache_ttl
+    start_date, end_date = date_window or (None, None)
+    if stream:
+        scraper_channels = __xmltv.stream_channels(
+            scraper_url, channel_ids.get(scraper_url), start_date, end_date
+        )
+    else:
+        scraper_channels = __xmltv.get_channels(
+            scraper_url, None, channel_ids.get(scraper_url), start_date, end_date
+        )
+    index = {}
+    for scraper_channel in scraper_channels:
+        dates = index.setdefault(scraper_channel.id, {})
+        for program in scraper_channel.programs:
+            dates.setdefault(program.start_time.date(), []).append(program)
+    return index
+
+
+def get_programs(scraper_url: str) -> dict[str, dict[date, list[Program]]]:
+    """
+    Get the indexed upstream XMLTV, downloaded and parsed once per build.
+    """
+    return single_flight.do(("xmltv", scraper_url), load_programs, scraper_url)
 
 
 def update(
     channel: Channel, scraper_params: str, dt: date = datetime.today().date()
 ) -> bool:
-    if scraper_params.find("@http") == -1:
-        scraper_url = scraper_params
-    else:
-        scraper_id = scraper_params.split("@http", 1)[0]
-        scraper_url = "http" + scraper_params.split("@http", 1)[1]
+    scraper_id, scraper_url = split_params(scraper_params)
     channel_id = channel.id if scraper_id == None else scraper_id
-    scraper_channels = __xmltv.get_channels(scraper_url)
-    for scraper_channel in scraper_channels:
-        if scraper_channel.id == channel_id:
-            for program in scraper_channel.programs:
-                start_time = program.start_time
-                if start_time.date() != dt:
-                    continue
-                end_time = program.end_time
-                title = program.title
-                # Purge channel programs on this date
-                channel.flush(dt)
-                # Update channel programs on this date
-                channel.programs.append(
-                    Program(title, start_time, end_time, channel.id)
-                )
-        channel.metadata.update(
-            {"last_update": datetime.now(timezone.utc).astimezone()}
+    programs = get_programs(scraper_url).get(channel_id, {}).get(dt)
+    if not programs:
+        return False
+    # Purge channel programs on this date
+    channel.flush(dt)
+    # Update channel programs on this date
+    for program in programs:
+        channel.programs.append(
+            Program(
+                program.title,
+                program.start_time,
+                program.end_time,
+                channel.id,
+                program.desc,
+                sub_title=program.sub_title,
+            )
         )
-        return True
-    return False
+    channel.metadata.update({"last_update": datetime.now(timezone.utc).astimezone()})
+    return True
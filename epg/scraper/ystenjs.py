@@ -1,32 +1,22 @@
 from epg.model import Channel, Program
 from datetime import datetime, date, timezone
-import requests
 import json
-from . import headers, tz_shanghai
+from . import session, async_get, tz_shanghai
 
-def update(
-    channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
-) -> bool:
-    # 根据传入的 scraper_id 或者 channel.id 获取频道的 UUID
-    channel_id = channel.id if scraper_id is None else scraper_id
-    
+
+def get_url(channel_id: str, dt: date, end_dt: date | None = None) -> str:
     # 格式化日期，准备请求参数
     start_date = dt.strftime("%Y%m%d")
-    end_date = dt.strftime("%Y%m%d")
+    end_date = (dt if end_dt is None else end_dt).strftime("%Y%m%d")
     
     # 构造 API 请求 URL
-    url = f"http://lvpepg.uni.jsa.bcs.ottcn.com:8080/cms-lvp-epg/lvps/getAllProgramlist?uuid={channel_id}&abilityString=%7B%22deviceGroupIds%22%3A%5B%225362%22%5D%2C%22districtCode%22%3A%22320900%22%7D&startDate={start_date}&endDate={end_date}"
-    
-    try:
-        # 发送请求
-        res = requests.get(url, headers=headers, timeout=5)
-    except:
-        print("Fail:", url)
-        return False
-    
+    return f"http://lvpepg.uni.jsa.bcs.ottcn.com:8080/cms-lvp-epg/lvps/getAllProgramlist?uuid={channel_id}&abilityString=%7B%22deviceGroupIds%22%3A%5B%225362%22%5D%2C%22districtCode%22%3A%22320900%22%7D&startDate={start_date}&endDate={end_date}"
+
+
+def get_programs_data(res) -> list | None:
     # 如果响应码不是 200，说明请求失败
     if res.status_code != 200:
-        return False
+        return None
     
     # 解析 JSON 数据
     data = json.loads(res.text)
@@ -34,33 +24,119 @@ def update(
     # 判断返回的 resultCode 是否为 "000"，即请求是否成功
     if data["resultCode"] != "000":
         print("API returned an error:", data.get("resultMessage"))
-        return False
+        return None
     
     # 获取内容部分
     content = data["content"]
     
-    # 如果没有找到相关内容，返回 False
+    # 如果没有找到相关内容，返回 None
     if not content:
-        return False
+        return None
     
     # 提取频道节目数据
-    programs_data = content[0]["programs"]  # 假设该频道在第一个列表项中
+    return content[0]["programs"]  # 假设该频道在第一个列表项中
+
+
+def make_program(channel: Channel, program: dict) -> Program:
+    title = program["programName"]
+    start_time = datetime.fromtimestamp(program["startTime"], tz=tz_shanghai)
+    end_time = datetime.fromtimestamp(program["endTime"], tz=tz_shanghai)
+    
+    # 创建并添加 Program 对象时传递 channel_id 参数
+    return Program(channel_id=channel.id, title=title, start_time=start_time, end_time=end_time)
+
+
+def parse_response(channel: Channel, res, dt: date) -> bool:
+    programs_data = get_programs_data(res)
+    if programs_data is None:
+        return False
     
     # 清空该频道的旧节目数据
     channel.flush(dt)
     
     # 遍历节目列表并更新节目数据
     for program in programs_data:
-        title = program["programName"]
-        start_time = datetime.fromtimestamp(program["startTime"], tz=tz_shanghai)
-        end_time = datetime.fromtimestamp(program["endTime"], tz=tz_shanghai)
-        
-        # 创建并添加 Program 对象时传递 channel_id 参数
-        channel.programs.append(
-            Program(channel_id=channel.id, title=title, start_time=start_time, end_time=end_time)
-        )
+        channel.programs.append(make_program(channel, program))
     
     # 更新频道的元数据
     channel.metadata.update({"last_update": datetime.now(timezone.utc).astimezone()})
     
     return True
+
+
+def parse_range_response(
+    channel: Channel, res, start_dt: date, end_dt: date
+) -> list[date]:
+    programs_data = get_programs_data(res)
+    if programs_data is None:
+        return []
+    
+    # 按日期拆分节目
+    programs_by_date: dict[date, list[Program]] = {}
+    for program in programs_data:
+        program = make_program(channel, program)
+        if start_dt <= program.start_time.date() <= end_dt:
+            programs_by_date.setdefault(program.start_time.date(), []).append(program)
+    
+    # 替换每一天的节目
+    for dt, programs in programs_by_date.items():
+        channel.flush(dt)
+        channel.programs.extend(programs)
+    
+    if programs_by_date:
+        channel.metadata.update({"last_update": datetime.now(timezone.utc).astimezone()})
+    
+    return list(programs_by_date)
+
+
+def update(
+    channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
+) -> bool:
+    # 根据传入的 scraper_id 或者 channel.id 获取频道的 UUID
+    channel_id = channel.id if scraper_id is None else scraper_id
+    url = get_url(channel_id, dt)
+    
+    try:
+        # 发送请求
+        res = session.get(url)
+    except:
+        print("Fail:", url)
+        return False
+    
+    return parse_response(channel, res, dt)
+
+
+async def update_async(
+    channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
+) -> bool:
+    channel_id = channel.id if scraper_id is None else scraper_id
+    url = get_url(channel_id, dt)
+    
+    try:
+        # 发送请求
+        res = await async_get(url)
+    except:
+        print("Fail:", url)
+        return False
+    
+    return parse_response(channel, res, dt)
+
+
+def update_range(
+    channel: Channel, scraper_id: str | None, start_dt: date, end_dt: date
+) -> list[date]:
+    """
+    Update all dates from start_dt to end_dt with one request.
+    Returns the dates updated.
+    """
+    channel_id = channel.id if scraper_id is None else scraper_id
+    url = get_url(channel_id, start_dt, end_dt)
+    
+    try:
+        # 发送请求
+        res = session.get(url)
+    except:
+        print("Fail:", url)
+        return []
+    
+    return parse_range_response(channel, res, start_dt, end_dt)
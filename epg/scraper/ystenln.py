@@ -1,29 +1,19 @@
 from epg.model import Channel, Program
 from datetime import datetime, date, timezone
-import requests
 import json
-from . import headers, tz_shanghai
+from . import session, async_get, tz_shanghai
 
-def update(
-    channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
-) -> bool:
-    # 根据传入的 scraper_id 或者 channel.id 获取频道的 UUID
-    channel_id = channel.id if scraper_id is None else scraper_id
-    
+
+def get_url(channel_id: str, dt: date) -> str:
     # 格式化日期，准备请求参数
     start_date = dt.strftime("%Y%m%d")
     end_date = dt.strftime("%Y%m%d")
     
     # 构造 API 请求 URL
-    url = f"http://ottlnyd-cosepg.yys.mgtv.com:8084/ysten-epg/epg/findPlaybills.shtml?uuid={channel_id}&abilityString=%7B%22abilities%22%3A%5B%5D%2C%22businessGroupIds%22%3A%5B%5D%2C%22deviceGroupIds%22%3A%5B%223815%22%5D%2C%22districtCode%22%3A%22210200%22%2C%22userGroupIds%22%3A%5B%5D%2C%22userLabelIds%22%3A%5B%5D%7D&days=1"
-    
-    try:
-        # 发送请求
-        res = requests.get(url, headers=headers, timeout=5)
-    except:
-        print("Fail:", url)
-        return False
-    
+    return f"http://ottlnyd-cosepg.yys.mgtv.com:8084/ysten-epg/epg/findPlaybills.shtml?uuid={channel_id}&abilityString=%7B%22abilities%22%3A%5B%5D%2C%22businessGroupIds%22%3A%5B%5D%2C%22deviceGroupIds%22%3A%5B%223815%22%5D%2C%22districtCode%22%3A%22210200%22%2C%22userGroupIds%22%3A%5B%5D%2C%22userLabelIds%22%3A%5B%5D%7D&days=1"
+
+
+def parse_response(channel: Channel, res, dt: date) -> bool:
     # 如果响应码不是 200，说明请求失败
     if res.status_code != 200:
         return False
@@ -67,3 +57,36 @@ def update(
     channel.metadata.update({"last_update": datetime.now(timezone.utc).astimezone()})
     
     return True
+
+
+def update(
+    channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
+) -> bool:
+    # 根据传入的 scraper_id 或者 channel.id 获取频道的 UUID
+    channel_id = channel.id if scraper_id is None else scraper_id
+    url = get_url(channel_id, dt)
+    
+    try:
+        # 发送请求
+        res = session.get(url)
+    except:
+        print("Fail:", url)
+        return False
+    
+    return parse_response(channel, res, dt)
+
+
+async def update_async(
+    channel: Channel, scraper_id: str | None = None, dt: date = datetime.today().date()
+) -> bool:
+    channel_id = channel.id if scraper_id is None else scraper_id
+    url = get_url(channel_id, dt)
+    
+    try:
+        # 发送请求
+        res = await async_get(url)
+    except:
+        print("Fail:", url)
+        return False
+    
+    return parse_response(channel, res, dt)
@@ -7,9 +7,34 @@ Maybe I should add a verbose option. Or use logging.
 
 import yaml
 import importlib
-from epg.model import Channel
+import asyncio
+import bisect
+import heapq
+import threading
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from epg.model import Channel, Program
 from datetime import datetime, date, timedelta
-from epg.scraper import tz_shanghai
+from epg import scraper as scraper_package
+from epg.scraper import tz_shanghai, track_transport_errors
+from epg.scraper.__limiter import CircuitBreaker
+
+# Max concurrent requests per scraper in the build runner. Every scraper talks
+# to a single upstream host, so this is effectively a per-host cap.
+# Scrapers not listed here use default_source_limit.
+source_limits: dict[str, int] = {"tvmao": 2, "tvsou": 2}
+default_source_limit = 4
+_async_source_semaphores: dict[str, asyncio.Semaphore] = {}
+
+# A scraper is skipped for breaker_cooldown seconds after
+# breaker_threshold consecutive transport failures.
+breaker_threshold = 5
+breaker_cooldown = 60.0
+_circuit_breakers: dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+# Gaps between programs up to merge_max_gap seconds are closed by merge_programs
+merge_max_gap = 15 * 60
 
 
 def load_config(path: str) -> list[Channel]:
@@ -38,21 +63,85 @@ def load_config(path: str) -> list[Channel]:
                         lambda channel, date: scrap_channel(
                             channel, channels_config, date
                         ),
+                        lambda channel, date: scrap_channel_async(
+                            channel, channels_config, date
+                        ),
+                        lambda channel, start_date, end_date: scrap_channel_range(
+                            channel, channels_config, start_date, end_date
+                        ),
                     )
                 )
+            prepare_scrapers(channels_config)
         except yaml.YAMLError as exc:
             print(exc)
     return channels
 
-def fetch_data(url):
-    try:
-        # 如果抓取失败，捕获异常并返回 None
-        response = requests.get(url, verify=False)
-        response.raise_for_status()  # 检查是否请求成功
-        return response.text
-    except requests.exceptions.RequestException as e:
-        print(f"请求失败: {e}")
-        return None
+
+def prepare_scrapers(channels_config: dict) -> None:
+    """
+    Tell the scrapers defining prepare(channels, start_date, end_date) which
+    channels and dates this build needs, so they can skip the rest of a source.
+
+    Args:
+        channels_config (dict): The channels config.
+    """
+    today = datetime.now().date()
+    start_date = end_date = today
+    scraper_channels = {}
+    for channel_id, metadata in channels_config.items():
+        start_date = min(start_date, today - timedelta(metadata.get("recap") or 0))
+        end_date = max(end_date, today + timedelta(metadata.get("preview") or 0))
+        for scraper, scraper_id in (metadata.get("scraper") or {}).items():
+            scraper_channels.setdefault(scraper, []).append((channel_id, scraper_id))
+    for scraper, prepared_channels in scraper_channels.items():
+        try:
+            scraper_module = importlib.import_module("epg.scraper" + "." + scraper)
+        except ImportError as e:
+            print(f"抓取器 {scraper} 加载失败，错误: {e}")
+            continue
+        prepare = getattr(scraper_module, "prepare", None)
+        if prepare is not None:
+            prepare(prepared_channels, start_date, end_date)
+
+
+def circuit_breaker(scraper: str) -> CircuitBreaker:
+    """
+    Get the circuit breaker of a scraper.
+
+    Args:
+        scraper (str): The scraper name.
+
+    Returns:
+        CircuitBreaker: The circuit breaker of the scraper.
+    """
+    with _circuit_breakers_lock:
+        if scraper not in _circuit_breakers:
+            _circuit_breakers[scraper] = CircuitBreaker(
+                breaker_threshold, breaker_cooldown
+            )
+        return _circuit_breakers[scraper]
+
+
+def record_scraper_result(scraper: str, data, transport_errors: int) -> None:
+    """
+    Feed the result of a scraper call to its circuit breaker.
+    Only transport failures count, a source without data for a date is not down.
+
+    Args:
+        scraper (str): The scraper name.
+        data: The return value of the scraper, False if it raised.
+        transport_errors (int): The number of transport errors during the call.
+    """
+    breaker = circuit_breaker(scraper)
+    if data:
+        breaker.record_success()
+    elif transport_errors > 0:
+        breaker.record_failure()
+        if breaker.is_open:
+            print(f"抓取器 {scraper} 连续失败，熔断 {breaker.cooldown} 秒。")
+    else:
+        breaker.release()
+
 
 def scrap_channel(
     channel, channels_config, date: date = datetime.today().date()
@@ -63,9 +152,21 @@ def scrap_channel(
         scraper_module = importlib.import_module("epg.scraper" + "." + scraper)
         update = getattr(scraper_module, "update")
         
+        # 如果来源已熔断，直接尝试下一个抓取器
+        if not circuit_breaker(scraper).allow():
+            print(f"抓取器 {scraper} 已熔断，跳过此抓取器，尝试下一个。")
+            continue
+        
         try:
             # 尝试抓取数据
-            data = update(channel, channels_config[channel.id]["scraper"][scraper], date)
+            data = False
+            with track_transport_errors() as transport_errors:
+                try:
+                    data = update(
+                        channel, channels_config[channel.id]["scraper"][scraper], date
+                    )
+                finally:
+                    record_scraper_result(scraper, data, transport_errors[0])
             
             # 如果抓取成功但数据为空，跳到下一个抓取器
             if not data:
@@ -91,11 +192,145 @@ def scrap_channel(
     print(f"所有抓取器都失败了，无法抓取频道 {channel.id} 数据。")
     return False  # 如果所有抓取器都失败，返回失败
 
+
+async def scrap_channel_async(channel, channels_config, date: date) -> bool:
+    """
+    Coroutine version of scrap_channel.
+    Prefers update_async() of a scraper, otherwise runs update() in a worker thread.
+    """
+    channel.metadata["last_scraper"] = "FAILED"
+
+    for scraper in channels_config[channel.id]["scraper"]:
+        scraper_module = importlib.import_module("epg.scraper" + "." + scraper)
+        scraper_id = channels_config[channel.id]["scraper"][scraper]
+
+        if not circuit_breaker(scraper).allow():
+            print(f"抓取器 {scraper} 已熔断，跳过此抓取器，尝试下一个。")
+            continue
+
+        try:
+            data = False
+            with track_transport_errors() as transport_errors:
+                try:
+                    async with async_source_semaphore(scraper):
+                        if hasattr(scraper_module, "update_async"):
+                            data = await scraper_module.update_async(
+                                channel, scraper_id, date
+                            )
+                        else:
+                            data = await asyncio.to_thread(
+                                scraper_module.update, channel, scraper_id, date
+                            )
+                finally:
+                    record_scraper_result(scraper, data, transport_errors[0])
+
+            if not data:
+                print(f"抓取器 {scraper} 成功执行，但没有返回数据，跳过此抓取器，尝试下一个。")
+                continue
+
+            channel.metadata["last_scraper"] = scraper
+            channel.metadata["last_update"] = datetime.now().astimezone()
+
+            if channel.metadata.get("plugin") is not None:
+                plugin_module = importlib.import_module(
+                    "epg.plugin" + "." + channel.metadata["plugin"]
+                )
+                plugin_update = getattr(plugin_module, "update")
+                await asyncio.to_thread(plugin_update, channel, date)
+
+            return True
+        except Exception as e:
+            print(f"抓取器 {scraper} 失败，错误: {e}，跳过此抓取器，尝试下一个抓取器。")
+            continue
+
+    print(f"所有抓取器都失败了，无法抓取频道 {channel.id} 数据。")
+    return False
+
+
+async def scrap_channel_range(
+    channel, channels_config, start_date: date, end_date: date
+) -> set[date]:
+    """
+    Update a date range with one request.
+    Only used if the first scraper of the channel defines
+    update_range(channel, scraper_id, start_date, end_date) -> list[date],
+    so the fallback order of the scrapers is kept.
+    The blocking update_range runs in a worker thread, under the same
+    per-scraper semaphore as the requests of scrap_channel_async.
+
+    Returns:
+        set[date]: The dates updated, the others are left to scrap_channel_async.
+    """
+    scrapers = channels_config[channel.id].get("scraper") or {}
+    if not scrapers:
+        return set()
+    scraper = next(iter(scrapers))
+    scraper_module = importlib.import_module("epg.scraper" + "." + scraper)
+    update_range = getattr(scraper_module, "update_range", None)
+    if update_range is None or start_date >= end_date:
+        return set()
+    if not circuit_breaker(scraper).allow():
+        return set()
+
+    try:
+        dates = []
+        with track_transport_errors() as transport_errors:
+            try:
+                async with async_source_semaphore(scraper):
+                    dates = await asyncio.to_thread(
+                        update_range,
+                        channel,
+                        scrapers[scraper],
+                        start_date,
+                        end_date,
+                    )
+            finally:
+                record_scraper_result(scraper, dates, transport_errors[0])
+
+        if not dates:
+            return set()
+
+        channel.metadata["last_scraper"] = scraper
+        channel.metadata["last_update"] = datetime.now().astimezone()
+
+        if channel.metadata.get("plugin") is not None:
+            plugin_module = importlib.import_module(
+                "epg.plugin" + "." + channel.metadata["plugin"]
+            )
+            plugin_update = getattr(plugin_module, "update")
+            for day in sorted(dates):
+                await asyncio.to_thread(plugin_update, channel, day)
+
+        return set(dates)
+    except Exception as e:
+        print(f"抓取器 {scraper} 按日期范围抓取失败，错误: {e}，改为逐日抓取。")
+        return set()
+
+
+def async_source_semaphore(scraper: str) -> asyncio.Semaphore:
+    """
+    Get the semaphore limiting concurrent requests of a scraper in the asyncio runner.
+
+    Args:
+        scraper (str): The scraper name.
+
+    Returns:
+        asyncio.Semaphore: The semaphore of the scraper.
+    """
+    if scraper not in _async_source_semaphores:
+        _async_source_semaphores[scraper] = asyncio.Semaphore(
+            source_limits.get(scraper, default_source_limit)
+        )
+    return _async_source_semaphores[scraper]
+
+
 def copy_channels(
     channels: list[Channel], new_channels: list[Channel]
 ) -> tuple[int, set]:
     """
     Copy channels from new_channels to channels.
+    Only the days in the recap/preview window of each channel are copied,
+    duplicates are left to merge_programs.
 
     Args:
         channels (list[Channel]): The channels to copy to.
@@ -106,189 +341,190 @@ def copy_channels(
     """
     num_reuse_channels = 0
     dates = set()
+    new_channels_by_id = {new_channel.id: new_channel for new_channel in new_channels}
+    today = datetime.now().date()
     for channel in channels:
-        for new_channel in new_channels:
-            if channel.id == new_channel.id:
-                # Keep the programs in recap days
-                for program in new_channel.programs:
-                    recap_days = (
-                        channel.metadata.get("recap")
-                        if channel.metadata.get("recap") != None
-                        else 0
-                    )
-                    preview_days = (
-                        channel.metadata.get("preview")
-                        if channel.metadata.get("preview") != None
-                        else 0
-                    )
-                    if (
-                        datetime.now().date() + timedelta(preview_days)
-                        >= program.start_time.date()
-                        >= datetime.now().date() - timedelta(recap_days)
-                    ):
-                        dates.add(program.start_time.date())
-                        channel.programs.append(program)
-                num_reuse_channels += 1
-                channel.programs = list(set(channel.programs))  # Remove duplicates
-                # print("reuse channel:", channel.id, channel.metadata["name"], xml_channel.metadata["last_update"].astimezone().isoformat(), channel.metadata["refresh"])
-                if channel.programs != []:
-                    channel.metadata["last_update"] = new_channel.metadata[
-                        "last_update"
-                    ]
-                else:
-                    channel.metadata["last_update"] = datetime(
-                        1970, 1, 1, 0, 0, 0, tzinfo=tz_shanghai
-                    )
-                break
+        new_channel = new_channels_by_id.get(channel.id)
+        if new_channel is None:
+            continue
+        # Keep the programs in recap and preview days
+        recap_days = channel.metadata.get("recap") or 0
+        preview_days = channel.metadata.get("preview") or 0
+        for day, programs in new_channel.programs.days(
+            today - timedelta(recap_days), today + timedelta(preview_days)
+        ):
+            dates.add(day)
+            channel.programs.extend(programs)
+        num_reuse_channels += 1
+        # print("reuse channel:", channel.id, channel.metadata["name"], xml_channel.metadata["last_update"].astimezone().isoformat(), channel.metadata["refresh"])
+        if len(channel.programs) > 0:
+            channel.metadata["last_update"] = new_channel.metadata["last_update"]
+        else:
+            channel.metadata["last_update"] = datetime(
+                1970, 1, 1, 0, 0, 0, tzinfo=tz_shanghai
+            )
     return (num_reuse_channels, dates)
 
 
-def update_preview(channel: Channel) -> int:
+def clip_overlaps(programs: list[Program]) -> tuple[list[Program], int]:
+    """
+    Clip each program at the start of the next one, programs sorted by start time.
+    Of programs starting at the same time, the first is kept.
+
+    Returns:
+        tuple[list[Program], int]: The programs and the number dropped or re-timed.
+    """
+    clipped = []
+    changed = 0
+    for program in programs:
+        if clipped and program.start == clipped[-1].start:
+            changed += 1
+            continue
+        if clipped and (clipped[-1].stop is None or clipped[-1].stop > program.start):
+            clipped[-1].stop = program.start
+            changed += 1
+        clipped.append(program)
+    return clipped, changed
+
+
+def merge_programs(channel: Channel, max_gap: int = merge_max_gap) -> int:
     """
-    Update channel preview.
+    Reconcile the overlapping and duplicate programs of a channel.
+    Freshly scraped programs win over the ones reused from the last XMLTV
+    (tagged "@xmltv"): a reused program starting inside a fresh one is dropped,
+    one running into a fresh one is clipped at its start.
+    Remaining overlaps are clipped at the start of the next program, which also
+    clips a program spilling over midnight into the next day, and gaps up to
+    max_gap seconds are closed by extending the earlier program.
 
     Args:
-        channel (Channel): The channel to update.
+        channel (Channel): The channel to merge.
+        max_gap (int): The longest gap to close, in seconds.
 
     Returns:
-        int: The number of days previewed."""
-    previewed_days = 0
-    if channel.metadata.get("preview") == None:
-        return previewed_days
-    if channel.metadata["preview"] > 0:
-        max_date = datetime.now().date() + timedelta(channel.metadata["preview"])
-        pointer_date = datetime.now().date()
-        # for program in channel.programs:
-        #     if program.start_time.date() > channel_max_date:
-        #         channel_max_date = program.start_time.date()
-        if pointer_date < max_date:
-            print("preview <- ", end="", flush=True)
-        else:
-            print("no need to refresh preview", flush=True)
-        while pointer_date < max_date:
-            pointer_date += timedelta(1)
-            if channel.update(pointer_date):
-                previewed_days += 1
-                if pointer_date < max_date:
-                    print(
-                        pointer_date,
-                        channel.metadata["last_scraper"],
-                        end=", ",
-                        flush=True,
-                    )
-                else:
-                    print(pointer_date, channel.metadata["last_scraper"], flush=True)
-    return previewed_days
+        int: The number of programs dropped or re-timed.
+    """
+    fresh = []
+    reused = []
+    for program in channel.programs:
+        (reused if program.channel.endswith("@xmltv") else fresh).append(program)
+    fresh, changed = clip_overlaps(fresh)
+
+    fresh_starts = array("q", (program.start for program in fresh))
+    fresh_stops = array("q", (program.stop or program.start for program in fresh))
+    kept = []
+    for program in reused:
+        index = bisect.bisect_right(fresh_starts, program.start) - 1
+        if index >= 0 and program.start < fresh_stops[index]:
+            changed += 1
+            continue
+        index += 1
+        if index < len(fresh_starts) and (
+            program.stop is None or program.stop > fresh_starts[index]
+        ):
+            program.stop = fresh_starts[index]
+            changed += 1
+        kept.append(program)
+
+    merged, clipped = clip_overlaps(
+        list(heapq.merge(fresh, kept, key=lambda x: x.start))
+    )
+    changed += clipped
+    for program, next_program in zip(merged, merged[1:]):
+        if program.stop is not None and 0 < next_program.start - program.stop <= max_gap:
+            program.stop = next_program.start
+            changed += 1
 
+    if changed:
+        channel.programs = merged
+    return changed
 
-def update_recap(channel: Channel) -> int:
+
+def refresh_dates(channel: Channel) -> list[date]:
     """
-    Update channel recap.
+    Get the dates to refresh in this build from the refresh, recap and preview
+    metadata. Recap days already held before the first program date are skipped.
 
     Args:
-        channel (Channel): The channel to update.
+        channel (Channel): The channel to refresh.
 
     Returns:
-        int: The number of days recaped."""
-    recaped_days = 0
-    if channel.metadata.get("recap") == None:
-        return recaped_days
-    if channel.metadata["recap"] > 0:
-        min_date = datetime.now().date() - timedelta(channel.metadata["recap"])
-        pointer_date = min_date
-        max_date = datetime.now().date()
-        for program in channel.programs:
-            if program.start_time.date() < max_date:
-                max_date = program.start_time.date()
-        if pointer_date < max_date:
-            print(
-                "recap",
-                min_date,
-                "->",
-                str(max_date - timedelta(1)) + ":",
-                end=" ",
-                flush=True,
-            )
-        else:
-            print("no need to refresh recap", flush=True)
+        list[date]: The recap dates, today and the preview dates, in order.
+    """
+    today = datetime.now().date()
+    if channel.metadata["refresh"] == "once":
+        if channel.metadata["last_update"].date() == today:
+            return []
+    elif channel.metadata["refresh"] != "today":
+        return []
+    dates = []
+    if (channel.metadata.get("recap") or 0) > 0:
+        pointer_date = today - timedelta(channel.metadata["recap"])
+        max_date = today
+        program_dates = channel.programs.dates()
+        if program_dates and program_dates[0] < max_date:
+            max_date = program_dates[0]
         while pointer_date < max_date:
-            if channel.update(pointer_date):
-                recaped_days += 1
-                if recaped_days < channel.metadata.get("recap"):
-                    print(
-                        pointer_date,
-                        channel.metadata["last_scraper"],
-                        end=", ",
-                        flush=True,
-                    )
-                else:
-                    print(pointer_date, channel.metadata["last_scraper"], flush=True)
+            dates.append(pointer_date)
             pointer_date += timedelta(1)
-    return recaped_days
+    dates.append(today)
+    for days in range(1, (channel.metadata.get("preview") or 0) + 1):
+        dates.append(today + timedelta(days))
+    return dates
 
 
-def update_channel_full(channel, num_refresh_channels):
+async def update_channels_async(channels: list[Channel], max_workers: int = 8) -> int:
     """
-    Update channel full.
+    Update all channels on one event loop.
+    Channels are refreshed concurrently, the dates of a channel one after another.
+    Scrapers without update_async() run in a pool of max_workers threads.
 
     Args:
-        channel (Channel): The channel to update.
-        num_refresh_channels (int): Counter of the number of channels that have been refreshed.
-    """
-
-    def _update_recap(channel):
-        recaped_days = update_recap(channel)
-        if recaped_days > 0:
-            print("total:", recaped_days, flush=True)
-            return True
-        return False
+        channels (list[Channel]): The channels to update.
+        max_workers (int): The number of threads for blocking scrapers.
 
-    def _update_preview(channel):
-        previewed_days = update_preview(channel)
-        if previewed_days > 0:
-            print("total:", previewed_days, flush=True)
-            return True
-        return False
+    Returns:
+        int: The number of refreshed channels.
+    """
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=max_workers))
+    _async_source_semaphores.clear()
 
-    if channel.metadata["refresh"] == "today":
+    async def _update(index, channel):
+        dates = refresh_dates(channel)
+        if dates == []:
+            return False
+        last_update = channel.metadata["last_update"]
+        results = []
+        covered = set()
+        if len(dates) > 1:
+            # One request for the whole window if the source supports it
+            covered = await channel.update_range(dates[0], dates[-1])
+            if covered:
+                results.append(
+                    f"{min(covered)} -> {max(covered)} {channel.metadata['last_scraper']}"
+                )
+        for pointer_date in dates:
+            if pointer_date in covered:
+                continue
+            if await channel.update_async(pointer_date):
+                results.append(f"{pointer_date} {channel.metadata['last_scraper']}")
         print(
-            num_refresh_channels + 1,
+            index + 1,
             channel.id,
             channel.metadata["name"],
             "last update:",
-            channel.metadata["last_update"],
-        )
-        _update_recap(channel)
-        print(
-            channel.metadata["refresh"],
-            "<- now",
-            datetime.now().astimezone().isoformat(),
-            end=" ",
+            last_update,
+            "<-",
+            ", ".join(results) if results else "FAILED",
             flush=True,
         )
-        if channel.update():
-            print(channel.metadata["last_scraper"], flush=True)
-        _update_preview(channel)
         return True
-    if channel.metadata["refresh"] == "once":
-        if channel.metadata["last_update"].date() != datetime.now().date():
-            print(
-                num_refresh_channels + 1,
-                channel.id,
-                channel.metadata["name"],
-                "last update:",
-                channel.metadata["last_update"],
-            )
-            _update_recap(channel)
-            print(
-                channel.metadata["refresh"],
-                "<-",
-                datetime.now().isoformat(),
-                end=" ",
-                flush=True,
-            )
-            channel.update()
-            print(channel.metadata["last_scraper"], flush=True)
-            _update_preview(channel)
-            return True
-    return False
+
+    try:
+        refreshed = await asyncio.gather(
+            *(_update(index, channel) for index, channel in enumerate(channels))
+        )
+    finally:
+        await scraper_package.aclose()
+    return sum(refreshed)
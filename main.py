@@ -2,10 +2,16 @@ from jinja2 import Environment, FileSystemLoader
 from epg import utils
 from epg.generator import xmltv
 from epg.generator import diyp
+from epg.generator import compress
+from epg.generator import manifest
+from epg.generator import schedule
+from epg import scraper
 from epg.scraper import __xmltv
+from epg.scraper import xmltv as xmltv_scraper
 from lxml import etree
 from datetime import datetime, timezone
 from croniter import croniter
+import asyncio
 import os
 import shutil
 
@@ -20,6 +26,18 @@ if TZ == None:
         "!!!Please set TZ environment variables to define timezone or it will use system timezone by default!!!"
     )
 CRON_TRIGGER = os.getenv("CRON_TRIGGER", "0 0 * * *")
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "8"))
+SCRAPER_WORKERS = os.getenv("SCRAPER_WORKERS", "")  # e.g. "tvmao:2,tvsou:2"
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")  # e.g. "lighttv.tvmao.com:2,www.tvsou.com:1"
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", "5"))
+HTTP_CACHE = os.getenv("HTTP_CACHE", os.path.join("cache", "http.sqlite3"))
+HTTP_CACHE_SIZE = int(os.getenv("HTTP_CACHE_SIZE", "256"))  # MB
+CACHE_TTLS = os.getenv("CACHE_TTLS", "")  # e.g. "www.tvsou.com:3600"
+XMLTV_CACHE_TTL = float(os.getenv("XMLTV_CACHE_TTL", "0"))
+XMLTV_STREAM = os.getenv("XMLTV_STREAM", "false").lower() == "true"
+XMLTV_PRETTY = os.getenv("XMLTV_PRETTY", "true").lower() == "true"
+COMPRESS_FORMATS = os.getenv("COMPRESS_FORMATS", "gz")  # e.g. "gz,br,zst"
+DIYP_PACK = os.getenv("DIYP_PACK", "false").lower() == "true"
 next_cron_time = (
     croniter(CRON_TRIGGER, datetime.now(timezone.utc))
     .get_next(datetime)
@@ -40,8 +58,26 @@ epg_path = os.path.join(os.getcwd(), "web", "epg.xml")
 if not os.path.exists(os.path.join(os.getcwd(), "web")):
     os.mkdir(os.path.join(os.getcwd(), "web"))
 
+xmltv_scraper.stream = XMLTV_STREAM
 channels = utils.load_config(config_path)
 
+for scraper_workers in SCRAPER_WORKERS.split(","):
+    if ":" in scraper_workers:
+        scraper_name, workers = scraper_workers.split(":", 1)
+        utils.source_limits[scraper_name.strip()] = int(workers)
+for rate_limit in RATE_LIMITS.split(","):
+    if ":" in rate_limit:
+        host, rate = rate_limit.rsplit(":", 1)
+        scraper.rate_limits[host.strip()] = (float(rate), max(1, int(float(rate))))
+utils.breaker_threshold = BREAKER_THRESHOLD
+if HTTP_CACHE != "":
+    scraper.enable_cache(HTTP_CACHE, HTTP_CACHE_SIZE * 1024 * 1024)
+    for cache_ttl in CACHE_TTLS.split(","):
+        if ":" in cache_ttl:
+            host, ttl = cache_ttl.rsplit(":", 1)
+            scraper.cache_ttls[host.strip()] = float(ttl)
+    xmltv_scraper.cache_ttl = XMLTV_CACHE_TTL
+
 if XMLTV_URL == "":
     xml_channels = []
     print("!!!Please set XMLTV_URL environment variables to reuse XML!!!")
@@ -65,28 +101,39 @@ else:
             flush=True,
         )
 
-print("refreshing...")
+print("refreshing...", f"workers: {MAX_WORKERS}", flush=True)
 
-num_refresh_channels = 0
-for channel in channels:
-    if utils.update_channel_full(channel, num_refresh_channels):
-        num_refresh_channels += 1
+num_refresh_channels = asyncio.run(utils.update_channels_async(channels, MAX_WORKERS))
 
 print(
     f"number of refreshed channels: {num_refresh_channels}/{len(channels)}", flush=True
 )
 
+num_merged_programs = sum(utils.merge_programs(channel) for channel in channels)
+print(f"number of merged programs: {num_merged_programs}", flush=True)
+
 print("deploying...", flush=True)
 print("file path:", epg_path, flush=True)
-xmltv.write(epg_path, channels, "epghub")
-
-xml = open(epg_path, "rb")
-root = etree.XML(xml.read())
-valid = dtd.validate(root)
-if not valid:
-    print(dtd.error_log.filter_from_errors()[0])
-
-diyp.write(os.path.join(os.getcwd(), "web", "diyp_files"), channels)
+# Staged, epg.xml and its compressed siblings are replaced together at the end
+epg_staged = epg_path + ".new"
+xmltv.write(epg_staged, channels, "epghub", XMLTV_PRETTY, dtd)
+
+# Pre-compress for nginx gzip_static and the api server
+compress_formats = [x.strip() for x in COMPRESS_FORMATS.split(",") if x.strip()]
+# Cloudflare Pages uploads a fresh build and does not follow symlinks
+diyp_pack = os.path.join(os.getcwd(), "web", "diyp.pack")
+diyp.write(
+    os.path.join(os.getcwd(), "web", "diyp_files"),
+    channels,
+    compress_formats,
+    CF_PAGES == None,
+    MAX_WORKERS,
+    diyp_pack if DIYP_PACK else None,
+)
+# The pack of an earlier build would be served instead of the new generation
+if not DIYP_PACK and os.path.exists(diyp_pack):
+    os.remove(diyp_pack)
+schedule.write(os.path.join(os.getcwd(), "web", "schedule.json"), channels)
 
 # Load the template
 templateLoader = FileSystemLoader(searchpath=os.path.join(os.getcwd(), "templates"))
@@ -111,6 +158,7 @@ rendered_html = template.render(
     next_update_time=next_update_time,
     update_trigger=CRON_TRIGGER,
     timezone_offset=timezone_offset,
+    epg_gz="gz" in compress_formats,
 )
 
 open(os.path.join(os.getcwd(), "web", "index.html"), "w").write(rendered_html)
@@ -127,6 +175,28 @@ shutil.copyfile(
     os.path.join(os.getcwd(), "web", "robots.txt"),
 )
 
+num_compressed_files = compress.write(
+    [
+        epg_staged,
+        os.path.join(os.getcwd(), "web", "index.html"),
+        os.path.join(os.getcwd(), "web", "404.json"),
+    ],
+    compress_formats,
+    MAX_WORKERS,
+)
+print("compressed files:", num_compressed_files, compress_formats, flush=True)
+
+compress.replace(epg_staged, epg_path)
+# Written last, a new generation tells api/app.py to drop its cached responses
+manifest.write(
+    os.path.join(os.getcwd(), "web", "manifest.json"),
+    [
+        epg_path,
+        os.path.join(os.getcwd(), "web", "index.html"),
+        os.path.join(os.getcwd(), "web", "404.json"),
+    ],
+)
+
 if CF_PAGES != None:
     if CLOUDFLARE_API_TOKEN == None:
         print(
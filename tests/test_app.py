@@ -0,0 +1,219 @@
+import gzip
+import importlib.util
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+
+import pytest
+from werkzeug.test import EnvironBuilder, run_wsgi_app
+
+from epg.generator import compress, diyp, manifest, schedule
+from epg.model import Channel, Program
+from epg.scraper import tz_shanghai
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TODAY = datetime.now(tz_shanghai).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def make_channels() -> list[Channel]:
+    channels = []
+    for i in range(2):
+        channel = Channel(f"C{i}", {"name": [f"频道 {i}"]})
+        for hour in range(48):
+            start = TODAY + timedelta(hours=hour)
+            channel.programs.append(
+                Program(f"节目 {hour}", start, start + timedelta(hours=1), channel.id)
+            )
+        channels.append(channel)
+    return channels
+
+
+def load_app(web: str, pack: bool):
+    """
+    Build web/ in the current directory and import a fresh api/app.py over it.
+    """
+    shutil.copyfile(
+        os.path.join(ROOT, "templates", "404.json"), os.path.join(web, "404.json")
+    )
+    diyp.write(
+        os.path.join(web, "diyp_files"),
+        make_channels(),
+        ["gz"],
+        pack=os.path.join(web, "diyp.pack") if pack else None,
+    )
+    manifest.write(os.path.join(web, "manifest.json"), [os.path.join(web, "404.json")])
+    spec = importlib.util.spec_from_file_location(
+        "app_under_test", os.path.join(ROOT, "api", "app.py")
+    )
+    app = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(app)
+    return app
+
+
+@pytest.fixture(params=[True, False], ids=["pack", "files"])
+def app(request, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(tmp_path / "web")
+    app = load_app(str(tmp_path / "web"), request.param)
+    assert (app.load_pack() is not None) == request.param
+    return app
+
+
+def expected_body(ch: str, day: str) -> bytes:
+    with open(os.path.join("web", "diyp_files", ch, day + ".json"), "rb") as f:
+        return f.read()
+
+
+def get(app, path: str, query: dict, headers: dict):
+    """
+    Call the WSGI app as a server does, the body as the chunks it writes.
+    """
+    environ = EnvironBuilder(path, query_string=query, headers=headers).get_environ()
+    app_iter, status, response_headers = run_wsgi_app(app.app, environ)
+    try:
+        chunks = list(app_iter)
+    finally:
+        if hasattr(app_iter, "close"):
+            app_iter.close()
+    return status, response_headers, chunks
+
+
+@pytest.mark.parametrize("encoding", ["gzip", ""])
+def test_diyp_body(app, encoding):
+    day = TODAY.strftime("%Y-%m-%d")
+    for _ in range(2):  # A miss, then a cache hit
+        status, headers, chunks = get(
+            app,
+            "/diyp",
+            {"ch": "频道 1", "date": day},
+            {"Accept-Encoding": encoding},
+        )
+        assert status.startswith("200")
+        # gunicorn only writes bytes
+        assert all(type(chunk) is bytes for chunk in chunks)
+        body = b"".join(chunks)
+        assert int(headers["Content-Length"]) == len(body)
+        if encoding:
+            assert headers["Content-Encoding"] == encoding
+            body = gzip.decompress(body)
+        assert body == expected_body("频道 1", day)
+
+
+def test_diyp_not_found(app):
+    for _ in range(2):  # A miss, then a cache hit
+        status, _, chunks = get(
+            app, "/diyp", {"ch": "频道 9", "date": "2000-01-01"}, {}
+        )
+        assert status.startswith("200")
+        with open(os.path.join("web", "404.json"), "rb") as f:
+            assert b"".join(chunks) == f.read()
+    for query in ({}, {"ch": "频道 1"}, {"date": "2000-01-01"}):
+        status, _, _ = get(app, "/diyp", query, {})
+        assert status.startswith("422")
+
+
+def write_epg(content: bytes, formats: list[str]) -> None:
+    with open(os.path.join("web", "epg.xml.new"), "wb") as f:
+        f.write(content)
+    compress.write([os.path.join("web", "epg.xml.new")], formats)
+    compress.replace(os.path.join("web", "epg.xml.new"), os.path.join("web", "epg.xml"))
+
+
+def publish_manifest(app) -> None:
+    manifest.write(
+        os.path.join("web", "manifest.json"),
+        [os.path.join("web", "epg.xml"), os.path.join("web", "404.json")],
+    )
+    app.generation_checked = 0.0
+
+
+def test_epg_xml_validators_during_build(app):
+    write_epg(b"<tv>old</tv>" * 100, ["gz"])
+    publish_manifest(app)
+    _, headers, _ = get(app, "/epg.xml", {}, {"Accept-Encoding": "gzip"})
+    assert headers["ETag"] == '"%s-gzip"' % app.file_digests["epg.xml"][:32]
+    # The next build replaced epg.xml, the manifest is not written yet
+    write_epg(b"<tv>new</tv>" * 100, [])
+    assert not os.path.exists(os.path.join("web", "epg.xml.gz"))
+    status, headers, chunks = get(
+        app,
+        "/epg.xml",
+        {},
+        {"If-Range": '"%s"' % app.file_digests["epg.xml"][:32], "Range": "bytes=10-"},
+    )
+    assert status.startswith("200")
+    assert headers["ETag"] != '"%s"' % app.file_digests["epg.xml"][:32]
+    assert b"".join(chunks) == b"<tv>new</tv>" * 100
+    status, _, _ = get(app, "/epg.xml", {}, {"If-None-Match": headers["ETag"]})
+    assert status.startswith("304")
+
+
+def test_epg_xml_compressed_on_the_fly(app):
+    write_epg(b"<tv>on the fly</tv>" * 100, [])
+    publish_manifest(app)
+    # The algorithms flask_compress streams with differ between its versions
+    algorithm = app.on_the_fly_algorithms(True)[-1]
+    status, headers, _ = get(app, "/epg.xml", {}, {"Accept-Encoding": algorithm})
+    assert status.startswith("200")
+    assert headers["Content-Encoding"] == algorithm
+    status, _, chunks = get(
+        app,
+        "/epg.xml",
+        {},
+        {"Accept-Encoding": algorithm, "If-None-Match": headers["ETag"]},
+    )
+    assert status.startswith("304")
+    assert b"".join(chunks) == b""
+
+
+def test_schedule_without_stops(app):
+    channels = make_channels()
+    channels[0].programs[1].stop = None
+    channels[0].programs[-1].stop = None
+    schedule.write(os.path.join("web", "schedule.json"), channels)
+    with open(os.path.join("web", "schedule.json")) as f:
+        rows = json.load(f)["channels"][0]["programs"]
+    assert len(rows) == len(channels[0].programs) - 1
+    assert rows[1][1] == channels[0].programs[2].start
+    # A schedule.json written before stops were filled in
+    rows.append([rows[-1][1], None, "节目", ""])
+    with open(os.path.join("web", "schedule.json"), "w") as f:
+        json.dump({"channels": [{"id": "C0", "name": "频道 0", "programs": rows}]}, f)
+    app.load_schedule()
+    assert len(app.schedule["C0"].programs) == len(rows) - 1
+    status, _, _ = get(app, "/now", {"ch": "频道 0"}, {})
+    assert status.startswith("200")
+
+
+def test_epg_xml_gz(app):
+    write_epg(b"<tv>gz</tv>" * 100, [])
+    publish_manifest(app)
+    status, _, _ = get(app, "/epg.xml.gz", {}, {})
+    assert status.startswith("404")
+    write_epg(b"<tv>gz</tv>" * 100, ["gz"])
+    publish_manifest(app)
+    status, headers, chunks = get(app, "/epg.xml.gz", {}, {})
+    assert status.startswith("200")
+    assert headers["ETag"] == '"%s-gzip"' % app.file_digests["epg.xml"][:32]
+    assert "Content-Encoding" not in headers
+    assert gzip.decompress(b"".join(chunks)) == b"<tv>gz</tv>" * 100
+    status, _, _ = get(app, "/epg.xml.gz", {}, {"If-None-Match": headers["ETag"]})
+    assert status.startswith("304")
+
+
+def test_pack_turned_off(app):
+    day = TODAY.strftime("%Y-%m-%d")
+    get(app, "/diyp", {"ch": "频道 1", "date": day}, {})
+    # The next build without DIYP_PACK, as main.py runs it
+    channels = make_channels()
+    channels[1].programs[0].title = "新节目"
+    diyp.write(os.path.join("web", "diyp_files"), channels, ["gz"])
+    if os.path.exists(os.path.join("web", "diyp.pack")):
+        os.remove(os.path.join("web", "diyp.pack"))
+    publish_manifest(app)
+    status, _, chunks = get(app, "/diyp", {"ch": "频道 1", "date": day}, {})
+    assert status.startswith("200")
+    assert "新节目".encode() in b"".join(chunks)
+    assert b"".join(chunks) == expected_body("频道 1", day)
+    assert app.load_pack() is None
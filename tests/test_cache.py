@@ -0,0 +1,137 @@
+import asyncio
+import importlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from epg import scraper
+
+cache_module = importlib.import_module("epg.scraper.__cache")
+ResponseCache = cache_module.ResponseCache
+SingleFlight = cache_module.SingleFlight
+
+
+class Handler(BaseHTTPRequestHandler):
+    body = b"<tv>guide</tv>"
+    requests: list[dict] = []
+
+    def do_GET(self):
+        Handler.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.send_header("ETag", '"v1"')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("ETag", '"v1"')
+        self.send_header("Last-Modified", "Mon, 01 Jan 2024 00:00:00 GMT")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    Handler.requests = []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}/epg.xml"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_revalidation_reuses_the_body_on_304(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(scraper, "response_cache", None)
+    monkeypatch.setattr(scraper, "rate_limits", {})
+    scraper.enable_cache(str(tmp_path / "http.sqlite3"))
+    first = scraper.session.get(server)
+    assert first.status_code == 200
+    second = scraper.session.get(server)
+    assert Handler.requests[1]["If-None-Match"] == '"v1"'
+    assert Handler.requests[1]["If-Modified-Since"] == "Mon, 01 Jan 2024 00:00:00 GMT"
+    # The server answered 304, the scraper gets the cached body
+    assert second.status_code == 200
+    assert second.content == Handler.body
+    assert len(Handler.requests) == 2
+
+
+class Clock:
+    now = 0.0
+
+    @classmethod
+    def time(cls) -> float:
+        cls.now += 1
+        return cls.now
+
+
+def test_lru_eviction_by_size(tmp_path, monkeypatch):
+    monkeypatch.setattr(cache_module, "time", Clock)
+    cache = ResponseCache(str(tmp_path / "http.sqlite3"), max_size=10)
+    cache.put("a", "a", {}, b"aaaa")
+    cache.put("b", "b", {}, b"bbbb")
+    assert cache.get("a").body == b"aaaa"
+    # Over the cap, the least recently used entry goes
+    cache.put("c", "c", {}, b"cccc")
+    assert cache.get("b") is None
+    assert cache.get("a").body == b"aaaa"
+    assert cache.get("c").body == b"cccc"
+    # Larger than the cache, never stored
+    cache.put("d", "d", {}, b"d" * 11)
+    assert cache.get("d") is None
+    assert cache.get("a") is not None
+
+
+def test_single_flight_calls_once_for_concurrent_callers():
+    single_flight = SingleFlight()
+    calls = []
+    barrier = threading.Barrier(8)
+    results = []
+
+    def fetch(page):
+        calls.append(page)
+        time.sleep(0.05)
+        return "parsed " + page
+
+    def caller():
+        barrier.wait()
+        results.append(single_flight.do(("test", "page"), fetch, "page"))
+
+    threads = [threading.Thread(target=caller) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == ["page"]
+    assert results == ["parsed page"] * 8
+    # Kept for the rest of the build
+    assert single_flight.do(("test", "page"), fetch, "page") == "parsed page"
+    assert calls == ["page"]
+    # Other keys are fetched apart
+    assert single_flight.do(("test", "other"), fetch, "other") == "parsed other"
+    assert calls == ["page", "other"]
+
+
+def test_single_flight_async_and_failures_not_kept():
+    single_flight = SingleFlight()
+    calls = []
+
+    async def fetch(page):
+        calls.append(page)
+        await asyncio.sleep(0.05)
+        return None
+
+    async def main():
+        return await asyncio.gather(
+            *(single_flight.do_async("key", fetch, "page") for _ in range(8))
+        )
+
+    assert asyncio.run(main()) == [None] * 8
+    assert calls == ["page"]
+    # A failed fetch is shared with the waiters, not with later callers
+    asyncio.run(main())
+    assert calls == ["page", "page"]
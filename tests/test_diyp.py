@@ -0,0 +1,29 @@
+import os
+
+from epg.generator import diyp
+
+from test_app import TODAY, make_channels
+
+
+def test_migrate_plain_directory(tmp_path):
+    dir = str(tmp_path / "diyp_files")
+    old = os.path.join(dir, "频道 0", "old.json")
+    os.makedirs(os.path.dirname(old))
+    with open(old, "w") as f:
+        f.write("{}")
+    diyp.write(dir, make_channels(), ["gz"])
+    assert os.path.islink(dir)
+    first = os.path.realpath(dir)
+    name = os.path.join("频道 0", TODAY.strftime("%Y-%m-%d") + ".json")
+    assert os.path.isfile(os.path.join(dir, name))
+    assert not os.path.exists(os.path.join(dir, "频道 0", "old.json"))
+    # Requests in flight may still read the moved directory until the next build
+    legacy = first + ".legacy"
+    assert os.path.isfile(os.path.join(legacy, "频道 0", "old.json"))
+    diyp.write(dir, make_channels(), ["gz"])
+    assert not os.path.exists(legacy)
+    # The previous generation is kept, linked into the new one
+    assert os.path.isfile(os.path.join(first, name))
+    assert os.path.samefile(os.path.join(first, name), os.path.join(dir, name))
+    diyp.write(dir, make_channels(), ["gz"])
+    assert not os.path.exists(first)
@@ -0,0 +1,55 @@
+import time
+
+import pytest
+
+from epg import utils
+from epg.scraper.__limiter import TokenBucket
+
+
+@pytest.fixture
+def breakers(monkeypatch):
+    monkeypatch.setattr(utils, "breaker_threshold", 3)
+    monkeypatch.setattr(utils, "breaker_cooldown", 0.05)
+    monkeypatch.setattr(utils, "_circuit_breakers", {})
+
+
+def test_breaker_opens_at_threshold_and_resets(breakers):
+    breaker = utils.circuit_breaker("test")
+    for _ in range(2):
+        utils.record_scraper_result("test", False, 1)
+    assert breaker.allow()
+    # Dates without data are not failures of the source
+    utils.record_scraper_result("test", False, 0)
+    assert not breaker.is_open
+    utils.record_scraper_result("test", False, 1)
+    assert breaker.is_open
+    assert not breaker.allow()
+    time.sleep(0.05)
+    # One trial call after the cooldown
+    assert breaker.allow()
+    assert not breaker.allow()
+    utils.record_scraper_result("test", True, 0)
+    assert not breaker.is_open
+    # The failures count from zero again
+    for _ in range(2):
+        utils.record_scraper_result("test", False, 1)
+    assert not breaker.is_open
+
+
+def test_breaker_failed_trial_opens_again(breakers):
+    breaker = utils.circuit_breaker("test")
+    for _ in range(3):
+        utils.record_scraper_result("test", False, 1)
+    time.sleep(0.05)
+    assert breaker.allow()
+    utils.record_scraper_result("test", False, 1)
+    assert breaker.is_open
+    assert not breaker.allow()
+
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(10.0, 2)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
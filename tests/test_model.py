@@ -0,0 +1,15 @@
+import pytest
+
+from test_app import make_channels
+
+
+def test_timeline_index():
+    timeline = make_channels()[0].programs
+    programs = list(timeline)
+    # The programs span two days
+    assert len(timeline.dates()) > 1
+    for i in range(-len(programs), len(programs)):
+        assert timeline[i] is programs[i]
+    assert timeline[20:30] == programs[20:30]
+    with pytest.raises(IndexError):
+        timeline[len(programs)]
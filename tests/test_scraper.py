@@ -0,0 +1,18 @@
+from epg import scraper
+from epg.scraper import xmltv as xmltv_scraper
+
+
+def test_xmltv_cache_ttl_is_per_url(monkeypatch):
+    url = "https://example.com/epg.xml"
+    monkeypatch.setattr(scraper, "cache_ttls", {"example.com": 60.0})
+    monkeypatch.setattr(xmltv_scraper, "cache_ttls", scraper.cache_ttls)
+    monkeypatch.setattr(xmltv_scraper, "cache_ttl", 3600.0)
+    monkeypatch.setattr(xmltv_scraper, "date_window", None)
+    monkeypatch.setattr(
+        xmltv_scraper.__xmltv, "get_channels", lambda *args, **kwargs: []
+    )
+    xmltv_scraper.load_programs(url)
+    assert scraper.cache_ttl(url) == 3600.0
+    # Other requests to the host keep its own TTL
+    assert scraper.cache_ttl("https://example.com/api?date=1") == 60.0
+    assert scraper.cache_ttl("https://other.example.com/epg.xml") == 0.0
@@ -0,0 +1,76 @@
+from datetime import datetime, timedelta
+
+from epg import utils
+from epg.model import Channel, Program
+from epg.scraper import tz_shanghai
+
+DAY = datetime(2024, 1, 1, tzinfo=tz_shanghai)
+
+
+def at(hour: float) -> datetime:
+    return DAY + timedelta(hours=hour)
+
+
+def program(title: str, start: float, stop: float | None, source: str = "C") -> Program:
+    return Program(title, at(start), None if stop is None else at(stop), source)
+
+
+def merged(*programs: Program, max_gap: int = 0) -> list[tuple]:
+    channel = Channel("C", {"name": ["C"]})
+    channel.programs = list(programs)
+    utils.merge_programs(channel, max_gap)
+    return [(p.title, p.start_time, p.end_time) for p in channel.programs]
+
+
+def test_fresh_programs_win_over_reused():
+    assert merged(
+        program("A", 10, 11),
+        program("B", 11, 12),
+        # Reused from the last XMLTV
+        program("X", 9, 10.5, "C@xmltv"),  # runs into A, clipped
+        program("Y", 10.5, 11.5, "C@xmltv"),  # starts inside A, dropped
+        program("Z", 12, 13, "C@xmltv"),  # after the fresh ones, kept
+    ) == [
+        ("X", at(9), at(10)),
+        ("A", at(10), at(11)),
+        ("B", at(11), at(12)),
+        ("Z", at(12), at(13)),
+    ]
+
+
+def test_overlapping_fresh_programs_are_clipped():
+    assert merged(program("A", 10, 12), program("B", 11, 13)) == [
+        ("A", at(10), at(11)),
+        ("B", at(11), at(13)),
+    ]
+
+
+def test_same_start_is_dropped_not_clipped_to_zero_length():
+    result = merged(
+        program("A", 10, 11),
+        program("B", 10, 10.5),
+        program("C", 11, None),
+        program("X", 11, 12, "C@xmltv"),
+    )
+    assert result == [("A", at(10), at(11)), ("C", at(11), None)]
+    assert all(stop is None or stop > start for _, start, stop in result)
+
+
+def test_open_stop_ends_at_the_next_program():
+    assert merged(program("A", 10, None), program("B", 11, 12)) == [
+        ("A", at(10), at(11)),
+        ("B", at(11), at(12)),
+    ]
+
+
+def test_gaps_are_closed_up_to_max_gap():
+    assert merged(
+        program("A", 10, 11),
+        program("B", 11.1, 12),
+        program("C", 13, 14),
+        max_gap=15 * 60,
+    ) == [
+        ("A", at(10), at(11.1)),
+        ("B", at(11.1), at(12)),
+        ("C", at(13), at(14)),
+    ]